@@ -1,34 +1,99 @@
-from sqlalchemy import create_engine
+from hydrus.data.engine import JOURNAL_MODES, SQLITE_PROFILES, SYNCHRONOUS, create_db_engine
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.orm import sessionmaker, scoped_session
 from hydrus.app import app_factory
 from hydrus.utils import Getter_setter
 from hydrus.data import doc_parse
+from hydrus.data.bulk import insert_batches, iter_objects
+from hydrus.data.exceptions import ClassNotFound, UserExists
+from hydrus.data.export import FORMATS, export
+from hydrus.data.maintenance import create_tables, migrate, move_terminals, optimize
+from hydrus.data.store import STORES, TERMINALS, configure_layout
 from hydrus.hydraspec import doc_maker
-from hydrus.data.db_models import Base
+from hydrus.prefork import listen, prefork
 from hydrus.data.user import add_user
-from gevent.wsgi import WSGIServer
 import json
+import time
 import click
 
-@click.command()
+
+@click.group()
+def hydrus():
+    """Python Hydrus CLI"""
+
+
+def layout_options(command):
+    """Add the storage layout options, passed to the command as layout and terminals."""
+    options = [
+        click.option("--layout", default=None, type=click.Choice(sorted(STORES)),
+                     help="Storage layout of the triples of a new database, an existing one must use it."),
+        click.option("--terminals", default=None, type=click.Choice(TERMINALS),
+                     help="Keep the literal values of a new database inline in the triples or in the "
+                          "terminals table, an existing one must keep them there."),
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
+
+
+def _configure_layout(session, layout, terminals) -> None:
+    """Check and record the storage layout of the database, refuse one that differs from the options."""
+    try:
+        configure_layout(session, layout, None if terminals is None else terminals == "inline")
+    except ValueError as e:
+        raise click.ClickException("%s, move it with hydrus db migrate" % e)
+
+
+def engine_options(command):
+    """Add the tuning options of the database engine, passed to the command as keyword arguments."""
+    options = [
+        click.option("--pool-size", default=5, type=int,
+                     help="Connections kept open by the pool, SQLite opens them as needed."),
+        click.option("--max-overflow", default=10, type=int,
+                     help="Connections opened beyond the pool size under load."),
+        click.option("--sqlite-profile", default="tuned", type=click.Choice(sorted(SQLITE_PROFILES)),
+                     help="Pragmas of SQLite connections, tuned uses WAL, a larger cache and memory mapping."),
+        click.option("--journal-mode", default=None, type=click.Choice(JOURNAL_MODES, case_sensitive=False),
+                     help="SQLite journal mode overriding the profile's, WAL lets readers run while a transaction is written."),
+        click.option("--synchronous", default=None, type=click.Choice(SYNCHRONOUS, case_sensitive=False),
+                     help="SQLite synchronous level overriding the profile's, NORMAL is safe with WAL and syncs less often."),
+        click.option("--statement-cache-size", default=None, type=int,
+                     help="Compiled SQL statements cached by the engine."),
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
+
+
+@hydrus.command()
 @click.option("--adduser", "-u", default=tuple([1, "test"]),
                 help="Adds a new user to the API.", nargs=2, type=(int, str))
 @click.option("--api", "-a", default="serverapi",
                 help="The API name.", type=str)
+@click.option("--asgi/--wsgi", default=False,
+                help="Serve the ASGI app with uvicorn and an async database driver, instead of gevent.")
 @click.option("--auth/--no-auth", default=True,
                 help="Set authentication to True or False.")
+@click.option("--db-url", default="sqlite:///:memory:",
+                help="SQLAlchemy URL of the database, e.g. sqlite:///database.db.", type=str)
 @click.option("--hydradoc", "-d", default="doc.jsonld",
                 help="Location to HydraDocumentation (JSON-LD) of server.",
                 type=click.File('r'))
 @click.option("--port", "-p", default=8080,
                 help="The port the app is hosted at.", type=int)
-@click.argument("serve", required=True)
-def startserver(adduser, api, auth, hydradoc, port, serve):
-    """Python Hydrus CLI"""
+@click.option("--workers", "-w", default=1, type=click.IntRange(min=1),
+                help="Server processes sharing the port, restarted when they exit.")
+@layout_options
+@engine_options
+def serve(adduser, api, asgi, auth, db_url, hydradoc, port, workers, layout, terminals, **engine_args):
+    """Start the Hydrus server."""
+
     # The database connection URL
     # See http://docs.sqlalchemy.org/en/rel_1_0/core/engines.html#sqlalchemy.create_engine for more info
-    # DB_URL = 'sqlite:///database.db'
-    DB_URL = 'sqlite:///:memory:'
+    DB_URL = db_url
+    url = make_url(DB_URL)
+    if workers > 1 and url.get_backend_name() == "sqlite" and url.database in [None, "", ":memory:"]:
+        raise click.BadParameter("an in-memory database is not shared by several workers", param_hint="--db-url")
 
     # Define the server URL, this is what will be displayed on the Doc
     HYDRUS_SERVER_URL = "http://localhost:" + str(port) + "/"
@@ -36,14 +101,6 @@ def startserver(adduser, api, auth, hydradoc, port, serve):
     # The name of the API or the EntryPoint, the api will be at http://localhost/<API_NAME>
     API_NAME = api
 
-    click.echo("Setting up the database")
-    # Create a connection to the database you want to use
-    engine = create_engine(DB_URL)
-
-    click.echo("Creating models")
-    # Add the required Models to the database
-    Base.metadata.create_all(engine)
-
     # Define the Hydra API Documentation
     # NOTE: You can use your own API Documentation and create a HydraDoc object using doc_maker
     #       Or you may create your own HydraDoc Documentation using doc_writer [see hydrus/hydraspec/doc_writer_sample]
@@ -51,28 +108,19 @@ def startserver(adduser, api, auth, hydradoc, port, serve):
     apidoc = doc_maker.create_doc(json.loads(hydradoc.read()),
                                     HYDRUS_SERVER_URL, API_NAME)
 
-    # Start a session with the DB and create all classes needed by the APIDoc
-    session = scoped_session(sessionmaker(bind=engine))
-
-    click.echo("Adding Classes and Properties")
-    # Get all the classes from the doc
-    classes = doc_parse.get_classes(apidoc.generate())     # You can also pass dictionary defined in hydrus/hydraspec/doc_writer_sample_output.py
-
-    # Get all the properties from the classes
-    properties = doc_parse.get_all_properties(classes)
+    if asgi:
+        return _serve_asgi(DB_URL, engine_args, layout, terminals, apidoc, adduser, HYDRUS_SERVER_URL, API_NAME,
+                           port, workers)
 
-    # Insert them into the database
-    doc_parse.insert_classes(classes, session)
-    doc_parse.insert_properties(properties, session)
-
-    click.echo("Adding authorized users")
-    add_user(id_=adduser[0], paraphrase=adduser[1], session=session)
+    from gevent.wsgi import WSGIServer
 
-    # Insert them into the database
-    doc_parse.insert_classes(classes, session)
-    doc_parse.insert_properties(properties, session)
+    click.echo("Setting up the database")
+    # Create a connection to the database you want to use
+    engine = create_db_engine(DB_URL, **engine_args)
+    _setup_database(engine, apidoc, adduser, layout, terminals)
 
-    getter_setter = Getter_setter(session, HYDRUS_SERVER_URL, API_NAME, apidoc, True)
+    # Every request gets its own session, greenlets of the same thread must not share one
+    getter_setter = Getter_setter(sessionmaker(bind=engine), HYDRUS_SERVER_URL, API_NAME, apidoc, True)
     
     print("Creating the application")
     # Create a Hydrus app with the API name you want, default will be "api"
@@ -81,8 +129,16 @@ def startserver(adduser, api, auth, hydradoc, port, serve):
     # Set the name of the API
     
     print("Starting the application")
-    
-    http_server = WSGIServer(('', 8080), app)
+
+    if workers > 1:
+        listener = listen(port)
+        # Every worker opens its own connections
+        engine.dispose()
+        print("Server running at:")
+        print(HYDRUS_SERVER_URL + API_NAME)
+        return prefork(workers, lambda: WSGIServer(listener, app).serve_forever())
+
+    http_server = WSGIServer(('', port), app)
     
     print("Server running at:")
     
@@ -94,5 +150,206 @@ def startserver(adduser, api, auth, hydradoc, port, serve):
         pass
 
 
+def _setup_database(engine, apidoc, adduser, layout, terminals) -> None:
+    """Create the tables, the classes and properties of the doc and the authorized user."""
+    click.echo("Creating models")
+    # Add the required Models to the database
+    create_tables(engine)
+
+    # Start a session with the DB and create all classes needed by the APIDoc
+    session = scoped_session(sessionmaker(bind=engine))
+    _configure_layout(session, layout, terminals)
+
+    click.echo("Adding Classes and Properties")
+    # Get all the classes from the doc
+    classes = doc_parse.get_classes(apidoc.generate())     # You can also pass dictionary defined in hydrus/hydraspec/doc_writer_sample_output.py
+
+    # Get all the properties from the classes
+    properties = doc_parse.get_all_properties(classes)
+
+    # Insert them into the database
+    doc_parse.insert_classes(classes, session)
+    doc_parse.insert_properties(properties, session, doc_parse.get_property_ranges(classes))
+
+    click.echo("Adding authorized users")
+    try:
+        add_user(id_=adduser[0], paraphrase=adduser[1], session=session)
+    except UserExists:
+        # Kept from a previous start on the same database
+        click.echo("User %d already exists" % adduser[0])
+    session.remove()
+
+
+def _serve_asgi(db_url, engine_args, layout, terminals, apidoc, adduser, hydrus_server_url, api_name, port,
+                workers) -> None:
+    """Serve the ASGI app with uvicorn, on an async engine of db_url."""
+    import asyncio
+    import uvicorn
+    from sqlalchemy.ext.asyncio import AsyncSession
+    from hydrus.asgi import AsyncGetter_setter, asgi_app_factory
+    from hydrus.data.engine import create_async_db_engine
+
+    click.echo("Setting up the database")
+    engine = create_async_db_engine(db_url, **engine_args)
+    getter_setter = AsyncGetter_setter(sessionmaker(bind=engine, class_=AsyncSession),
+                                       hydrus_server_url, api_name, apidoc, True)
+    app = asgi_app_factory(api_name, getter_setter)
+
+    async def setup() -> None:
+        async with engine.connect() as connection:
+            await connection.run_sync(lambda connection: _setup_database(connection.engine, apidoc, adduser, layout,
+                                                                         terminals))
+        click.echo("Server running at: " + hydrus_server_url + api_name)
+
+    async def run() -> None:
+        # The setup runs on the loop of the server, an in-memory database only lives on it
+        await setup()
+        await uvicorn.Server(uvicorn.Config(app, host="0.0.0.0", port=port)).serve()
+
+    if workers == 1:
+        return asyncio.run(run())
+
+    async def setup_once() -> None:
+        await setup()
+        # Every worker opens its own connections
+        await engine.dispose()
+
+    listener = listen(port)
+    asyncio.run(setup_once())
+    prefork(workers, lambda: asyncio.run(uvicorn.Server(uvicorn.Config(app)).serve(sockets=[listener])))
+
+
+@hydrus.command("import")
+@click.option("--api", "-a", default="serverapi",
+                help="The API name.", type=str)
+@click.option("--batch-size", "-b", default=1000,
+                help="Objects written per transaction.", type=int)
+@click.option("--db-url", default="sqlite:///database.db",
+                help="The database to import into.", type=str)
+@click.option("--hydradoc", "-d", default="doc.jsonld",
+                help="Location to HydraDocumentation (JSON-LD) of server.",
+                type=click.File('r'))
+@click.option("--type", "type_", default=None,
+                help="Only accept objects of this class.", type=str)
+@click.argument("objects", type=click.File('rb'))
+@layout_options
+@engine_options
+def import_(api, batch_size, db_url, hydradoc, type_, objects, layout, terminals, **engine_args):
+    """Import the objects of an NDJSON or JSON-LD array file."""
+    engine = create_db_engine(db_url, **engine_args)
+    create_tables(engine)
+    apidoc = doc_maker.create_doc(json.loads(hydradoc.read()), "http://localhost/", api)
+    session = scoped_session(sessionmaker(bind=engine))
+    _configure_layout(session, layout, terminals)
+
+    # Classes and properties already in the database are kept
+    classes = doc_parse.get_classes(apidoc.generate())
+    doc_parse.insert_classes(classes, session)
+    doc_parse.insert_properties(doc_parse.get_all_properties(classes), session,
+                                doc_parse.get_property_ranges(classes))
+
+    added = 0
+    start = time.perf_counter()
+    try:
+        for ids in insert_batches(iter_objects(objects), session, type_=type_, batch_size=batch_size):
+            added += len(ids)
+            click.echo("\r%d objects imported, %.0f objects/s" % (added, added / (time.perf_counter() - start)),
+                       nl=False, err=True)
+    except ValueError as e:
+        raise click.ClickException("%s after %d objects" % (e, added))
+    except Exception as e:
+        status_code, message = e.get_HTTP()
+        raise click.ClickException("%s after %d objects" % (message["message"], added))
+    finally:
+        session.remove()
+
+    elapsed = time.perf_counter() - start
+    click.echo("\nImported %d objects in %.1fs (%.0f objects/s)" % (added, elapsed, added / max(elapsed, 1e-9)),
+               err=True)
+
+
+@hydrus.command("export")
+@click.option("--api", "-a", default="serverapi",
+                help="The API name.", type=str)
+@click.option("--batch-size", "-b", default=500,
+                help="Objects read per query.", type=int)
+@click.option("--db-url", default="sqlite:///database.db",
+                help="The database to export from.", type=str)
+@click.option("--format", "format_", default="ndjson",
+                help="The output format.", type=click.Choice(FORMATS))
+@click.option("--server-url", default="http://localhost:8080/",
+                help="The server URL the IRIs of the objects start with.", type=str)
+@click.option("--type", "type_", default=None,
+                help="Only export objects of this class.", type=str)
+@click.argument("output", type=click.File('w'), default="-")
+@engine_options
+def export_(api, batch_size, db_url, format_, server_url, type_, output, **engine_args):
+    """Export the stored objects to a file, or to stdout."""
+    engine = create_db_engine(db_url, **engine_args)
+    session = scoped_session(sessionmaker(bind=engine))
+    try:
+        for chunk in export(api, session, format_, type_, server_url, batch_size):
+            output.write(chunk)
+    except ClassNotFound as e:
+        status_code, message = e.get_HTTP()
+        raise click.ClickException(message["message"])
+    finally:
+        session.remove()
+
+
+@hydrus.group()
+def db():
+    """Maintain an existing database."""
+
+
+@db.command("migrate")
+@click.option("--db-url", default="sqlite:///database.db",
+                help="The database to migrate.", type=str)
+@click.option("--terminals", default=None, type=click.Choice(TERMINALS),
+                help="Keep literal values inline in the triples or in the terminals table.")
+@click.option("--to", "layout", default=None, type=click.Choice(sorted(STORES)),
+                help="The storage layout to move the triples to.")
+def migrate_(db_url, terminals, layout):
+    """Move the triples to another storage layout or the literal values to another table."""
+    engine = create_db_engine(db_url)
+    create_tables(engine)
+    session = scoped_session(sessionmaker(bind=engine))
+    start = time.perf_counter()
+    try:
+        if layout is not None:
+            click.echo("Moved %d triples to the %s layout" % (migrate(session, layout), layout))
+        if terminals is not None:
+            click.echo("Moved %d values to the %s terminals" % (move_terminals(session, terminals == "inline"),
+                                                                terminals))
+    finally:
+        session.remove()
+    click.echo("Done in %.1fs" % (time.perf_counter() - start))
+
+
+@db.command("optimize")
+@click.option("--db-url", default="sqlite:///database.db",
+                help="The database to optimize.", type=str)
+def optimize_(db_url):
+    """Create missing indexes and report the size of every table and index."""
+    engine = create_db_engine(db_url)
+    create_tables(engine)
+    session = scoped_session(sessionmaker(bind=engine))
+    try:
+        report = optimize(session)
+    finally:
+        session.remove()
+    for name in report["created"]:
+        click.echo("Created index %s" % name)
+
+    def size(bytes_):
+        """Format a size in kilobytes."""
+        return "-" if bytes_ is None else "%.1f kB" % (bytes_ / 1024.0)
+
+    for table in report["tables"]:
+        click.echo("%-12s %10d rows %12s" % (table["name"], table["rows"], size(table["bytes"])))
+        for name, bytes_ in sorted(table["indexes"].items()):
+            click.echo("  %-34s %12s" % (name, size(bytes_)))
+
+
 if __name__ == "__main__":
-    startserver()
+    hydrus()
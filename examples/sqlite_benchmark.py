@@ -0,0 +1,116 @@
+"""Compare the write and concurrent read throughput of the SQLite profiles of create_db_engine.
+
+For every profile a new database file is filled with objects inserted one per
+transaction, like PUT requests do, then reader threads fetch objects while a writer
+thread keeps inserting. Run it as a module from the repository root, which puts
+hydrus on the import path without installing it:
+
+    python -m examples.sqlite_benchmark --objects 500 --readers 4 --seconds 5
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from sqlalchemy.orm import sessionmaker, scoped_session
+from hydrus.data import crud, doc_parse
+from hydrus.data.engine import SQLITE_PROFILES, create_db_engine
+from hydrus.data.maintenance import create_tables
+from hydrus.hydraspec.doc_writer_sample import api_doc
+from typing import Any, Dict, List
+
+
+def dummy_object() -> Dict[str, Any]:
+    """Return an object of the sample API Documentation."""
+    return {"@type": "dummyClass", "Prop1": str(random.random()), "Prop2": str(random.random())}
+
+
+def setup(path: str, profile: str) -> Any:
+    """Create a database with the classes of the sample API Documentation, return a session factory."""
+    engine = create_db_engine("sqlite:///" + path, sqlite_profile=profile)
+    create_tables(engine)
+    session = scoped_session(sessionmaker(bind=engine))
+    classes = doc_parse.get_classes(api_doc.generate())
+    doc_parse.insert_classes(classes, session)
+    doc_parse.insert_properties(doc_parse.get_all_properties(classes), session)
+    session.remove()
+    return session
+
+
+def bench_writes(session: Any, objects: int) -> float:
+    """Insert objects one per transaction, return the inserts per second."""
+    start = time.perf_counter()
+    for _ in range(objects):
+        crud.insert(dummy_object(), session=session)
+    elapsed = time.perf_counter() - start
+    session.remove()
+    return objects / elapsed
+
+
+def bench_concurrent(session: Any, ids: List[int], readers: int, seconds: float) -> Dict[str, float]:
+    """Read objects from readers threads while one thread writes, return both rates and the errors."""
+    counts = {"reads": 0, "writes": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def count(name: str) -> None:
+        with lock:
+            counts[name] += 1
+
+    def read() -> None:
+        while time.perf_counter() < deadline:
+            try:
+                crud.get(random.choice(ids), "dummyClass", api_name="api", session=session)
+                count("reads")
+            except Exception:
+                session.rollback()
+                count("errors")
+        session.remove()
+
+    def write() -> None:
+        while time.perf_counter() < deadline:
+            try:
+                crud.insert(dummy_object(), session=session)
+                count("writes")
+            except Exception:
+                session.rollback()
+                count("errors")
+        session.remove()
+
+    threads = [threading.Thread(target=read) for _ in range(readers)] + [threading.Thread(target=write)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {"reads/s": counts["reads"] / seconds, "writes/s": counts["writes"] / seconds,
+            "errors": counts["errors"]}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--objects", type=int, default=500, help="Objects inserted by the write benchmark.")
+    parser.add_argument("--readers", type=int, default=4, help="Reader threads of the concurrent benchmark.")
+    parser.add_argument("--seconds", type=float, default=5.0, help="Duration of the concurrent benchmark.")
+    parser.add_argument("--directory", default=None,
+                        help="Where the database files are created, fsync costs depend on the disk.")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(dir=args.directory)
+    try:
+        print("%-8s %12s %12s %12s %8s" % ("profile", "inserts/s", "reads/s", "writes/s", "errors"))
+        for profile in sorted(SQLITE_PROFILES):
+            session = setup(os.path.join(directory, profile + ".db"), profile)
+            inserts = bench_writes(session, args.objects)
+            concurrent = bench_concurrent(session, list(range(1, args.objects + 1)), args.readers, args.seconds)
+            print("%-8s %12.0f %12.0f %12.0f %8d" % (profile, inserts, concurrent["reads/s"],
+                                                     concurrent["writes/s"], concurrent["errors"]))
+            session.get_bind().dispose()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,19 @@
 """Main route for the applciation."""
 
 import json
+import time
 import falcon
 from hydrus.data import crud
+from hydrus.data.bulk import insert_batches, iter_objects
+from hydrus.data.filters import filter_params, search_template
+from hydrus.data.schema import get_schema
 from hydrus.data.user import check_authorization
-from hydrus.utils import get_doc, get_api_name, get_authentication, get_hydrus_server_url, get_session
+from hydrus.utils import (get_api_name, get_authentication, get_hydrus_server_url, get_session,
+                          get_page_size, get_max_page_size, get_dispatch, get_documents)
+from hydrus.dispatch import compile_dispatch
+from hydrus.documents import CACHE_CONTROL, Document, is_fresh, render_docs
 from hydrus.hydraspec import doc_writer_sample
-from typing import Dict, List, Any, Union
+from typing import Dict, List, Any, Tuple, Union
 
 
 
@@ -35,6 +42,36 @@ def set_response_headers(resp: falcon.Response, ct: str="application/ld+json", h
     return resp
 
 
+class Authentication(object):
+    """Middleware checking the credentials of a request once, before it reaches its resource.
+
+    Must be added after Getter_setter, whose context it reads. Requests to the exempt
+    resource classes are never checked; a rejected request is completed here, so neither
+    the resource nor its database work runs. The time spent is kept in
+    resp.context['auth_time'] and sent as an auth Server-Timing metric.
+    """
+
+    def __init__(self, exempt: Tuple[type, ...] = ()) -> None:
+        """Constructor."""
+        self.exempt = exempt
+
+    def process_resource(self, req, resp, resource, params):
+        if resource is None or isinstance(resource, self.exempt) or not get_authentication(resp):
+            return
+        start = time.perf_counter()
+        try:
+            if req.auth is None or check_authorization(req, get_session(resp)) is False:
+                failed_authentication(resp)
+                resp.complete = True
+        except Exception as e:
+            status_code, message = e.get_HTTP()  # type: ignore
+            resp.media = message
+            set_response_headers(resp, status_code=status_code)
+            resp.complete = True
+        resp.context['auth_time'] = time.perf_counter() - start
+        resp.append_header('Server-Timing', 'auth;dur=%.3f' % (resp.context['auth_time'] * 1000))
+
+
 # def set_response_headers(resp: Response, ct: str="application/ld+json", headers: List[Dict[str, Any]]=[], status_code = falcon.HTTP_200) -> Response:
 #
 #     resp.status_code = status_code
@@ -54,44 +91,46 @@ def hydrafy(resp: falcon.Response,object_: Dict[str, Any]) -> Dict[str, Any]:
 
 def checkEndpoint(resp: falcon.Response, method: str, type_: str) -> Dict[str, Union[bool, falcon.HTTPStatus]]:
     """Check if endpoint and method is supported in the API."""
-    status_code = falcon.HTTP_404
     if type_ == 'vocab':
         return {'method': False, 'status': falcon.HTTP_405}
 
-    for endpoint in get_doc(resp).entrypoint.entrypoint.supportedProperty:
-        if type_ == endpoint.name:
-            status_code = falcon.HTTP_405
-            for operation in endpoint.supportedOperation:
-                if operation.method == method:
-                    status_code = falcon.HTTP_200
-                    return {'method': True, 'status': status_code}
-    return {'method': False, 'status': status_code}
+    route = get_dispatch(resp).routes.get(type_)
+    if route is None:
+        return {'method': False, 'status': falcon.HTTP_404}
+    if method in route.methods:
+        return {'method': True, 'status': falcon.HTTP_200}
+    return {'method': False, 'status': falcon.HTTP_405}
 
 
 def getType(resp: falcon.Response, class_type: str, method: str) -> Any:
     """Return the @type of object allowed for POST/PUT."""
-    for supportedOp in get_doc(resp).parsed_classes[class_type]["class"].supportedOperation:
-        if supportedOp.method == method:
-            return supportedOp.expects.replace("vocab:", "")
-    # NOTE: Don't use split, if there are more than one substrings with 'vocab:' not everything will be returned.
+    return get_dispatch(resp).operations[class_type].get(method)
 
 
 def checkClassOp(resp: falcon.Response, class_type: str, method: str) -> bool:
     """Check if the Class supports the operation."""
-    for supportedOp in get_doc(resp).parsed_classes[class_type]["class"].supportedOperation:
-        if supportedOp.method == method:
-            return True
-    return False
+    return method in get_dispatch(resp).operations[class_type]
+
 
 
+def send_document(req: falcon.Request, resp: falcon.Response, document: Document) -> falcon.Response:
+    """Send a pre-rendered document, or 304 if the client already has it."""
+    headers = {'ETag': document.etag, 'Cache-Control': CACHE_CONTROL}
+    if is_fresh(req.get_header('If-None-Match'), document):
+        # A 304 has no body, so no Content-type either
+        resp.status = falcon.HTTP_304
+        resp.set_headers(headers)
+        return resp
+    resp.data = document.body
+    return set_response_headers(resp, headers=headers)
+
 
 class Index(object):
     """Class for the EntryPoint."""
 
     def on_get(self, req, resp):
         """Return main entrypoint for the api."""
-        resp.media = get_doc(resp).entrypoint.get()
-        resp = set_response_headers(resp)
+        return send_document(req, resp, get_documents(resp).index)
 
 
 
@@ -100,8 +139,7 @@ class Vocab(object):
 
     def on_get(self, req, resp):
         """Return the main hydra vocab."""
-        resp.media = get_doc(resp).generate()
-        resp = set_response_headers(resp)
+        return send_document(req, resp, get_documents(resp).vocab)
 
 
 class Entrypoint(object):
@@ -109,8 +147,7 @@ class Entrypoint(object):
 
     def on_get(self, req, resp):
         """Return application main Entrypoint."""
-        resp.media = {"@context": get_doc(resp).entrypoint.context.generate()}
-        resp = set_response_headers(resp)
+        return send_document(req, resp, get_documents(resp).entrypoint)
 
 class Item(object):
     """Handles all operations(GET, POST, PATCH, DELETE) on Items (item can be anything depending upon the vocabulary)."""
@@ -118,20 +155,7 @@ class Item(object):
     def on_get(self, req, resp, id_, type_):
         """GET object with id = id_ from the database."""
 
-        if get_authentication(resp):
-            if req.auth is None:
-                return failed_authentication(resp)
-            else:
-                try:
-                    auth = check_authorization(req, get_session(resp))
-                    if auth is False:
-                        return failed_authentication(resp)
-                except Exception as e:
-                    status_code, message = e.get_HTTP()  # type: ignore
-                    resp.media = message
-                    return set_response_headers(resp, status_code=status_code)
-
-        class_type = get_doc(resp).collections[type_]["collection"].class_.title
+        class_type = get_dispatch(resp).collections[type_]
 
         if checkClassOp(resp, class_type, "GET"):
 
@@ -152,20 +176,7 @@ class Item(object):
         :param id_ - ID of Item to be updated
         :param type_ - Type(Class name) of Item to be updated
         """
-        if get_authentication(resp):
-            if req.auth is None:
-                return failed_authentication(resp)
-            else:
-                try:
-                    auth = check_authorization(req, get_session(resp))
-                    if auth is False:
-                        return failed_authentication(resp)
-                except Exception as e:
-                    status_code, message = e.get_HTTP()  # type: ignore
-                    resp.media = message
-                    return set_response_headers(resp, status_code=status_code)
-
-        class_type = get_doc(resp).collections[type_]["collection"].class_.title
+        class_type = get_dispatch(resp).collections[type_]
 
         if checkClassOp(resp, class_type, "POST"):
             # Check if class_type supports POST operation
@@ -201,20 +212,7 @@ class Item(object):
         :param id_ - ID of Item to be updated
         :param type_ - Type(Class name) of Item to be updated
         """
-        if get_authentication(resp):
-            if req.auth is None:
-                return failed_authentication(resp)
-            else:
-                try:
-                    auth = check_authorization(req, get_session(resp))
-                    if auth is False:
-                        return failed_authentication(resp)
-                except Exception as e:
-                    status_code, message = e.get_HTTP()  # type: ignore
-                    resp.media = message
-                    return set_response_headers(resp, status_code=status_code)
-
-        class_type = get_doc(resp).collections[type_]["collection"].class_.title
+        class_type = get_dispatch(resp).collections[type_]
 
         if checkClassOp(resp, class_type, "PUT"):
             # Check if class_type supports PUT operation
@@ -246,20 +244,7 @@ class Item(object):
     def on_delete(self, req, resp, id_: int, type_: str):
         """Delete object with id=id_ from database."""
 
-        if get_authentication(resp):
-            if req.auth is None:
-                return failed_authentication(resp)
-            else:
-                try:
-                    auth = check_authorization(req, get_session(resp))
-                    if auth is False:
-                        return failed_authentication(resp)
-                except Exception as e:
-                    status_code, message = e.get_HTTP()  # type: ignore
-                    resp.media = message
-                    return set_response_headers(resp, status_code=status_code)
-
-        class_type = get_doc(resp).collections[type_]["collection"].class_.title
+        class_type = get_dispatch(resp).collections[type_]
 
         if checkClassOp(resp, class_type, "DELETE"):
             # Check if class_type supports PUT operation
@@ -286,26 +271,36 @@ class ItemCollection(object):
 
     def on_get(self, req, resp, type_):
         """Retrieve a collection of items from the database."""
-        if get_authentication(resp):
-            if req.auth is None:
-                return failed_authentication(resp)
-            else:
-                try:
-                    auth = check_authorization(req, get_session(resp))
-                    if auth is False:
-                        return failed_authentication(resp)
-                except Exception as e:
-                    status_code, message = e.get_HTTP()  # type: ignore
-                    resp.media = message
-                    return set_response_headers(resp, status_code=status_code)
-
         if checkEndpoint(resp, "GET", type_):
             # Collections
-            if type_ in get_doc(resp).collections:
-
-                collection = get_doc(resp).collections[type_]["collection"]
+            if type_ in get_dispatch(resp).collections:
+
+                class_type = get_dispatch(resp).collections[type_]
+                # ?expand=members embeds full member objects instead of links
+                expand = req.get_param("expand") == "members"
+                # Members are paged with an id-cursor, the page size is capped by the server
+                page_size = req.get_param_as_int("pageSize") or get_page_size(resp)
+                page_size = max(1, min(page_size, get_max_page_size(resp)))
+                after = req.get_param_as_int("after")
+                before = req.get_param_as_int("before")
+                # ?name=value, ?name[prefix]=text or ?speed[gt]=10 only return the members matching them
+                filters = filter_params(req.params, get_schema(get_session(resp)))
                 try:
-                    resp.media = hydrafy(resp, crud.get_collection(get_api_name(resp), collection.class_.title, session=get_session(resp)))
+                    if req.get_param_as_bool("stream"):
+                        # ?stream=true exports the whole collection, written as it is read from the database
+                        resp.stream = crud.stream_collection(get_api_name(resp), class_type,
+                                                             session=get_session(resp), expand=expand,
+                                                             context="/" + get_api_name(resp) + "/contexts/" +
+                                                             type_ + ".jsonld", filters=filters)
+                        return set_response_headers(resp)
+                    collection = crud.get_collection(get_api_name(resp), class_type, session=get_session(resp),
+                                                     expand=expand, page_size=page_size,
+                                                     after=after, before=before, filters=filters)
+                    # The filters a client can use, as a Hydra IriTemplate
+                    collection["search"] = search_template(collection["@id"],
+                                                           get_dispatch(resp).properties[class_type],
+                                                           get_schema(get_session(resp)))
+                    resp.media = hydrafy(resp, collection)
                     return set_response_headers(resp)
 
                 except Exception as e:
@@ -314,7 +309,7 @@ class ItemCollection(object):
                     return set_response_headers(resp, status_code=status_code)
 
             # Non Collection classes
-            elif type_ in get_doc(resp).parsed_classes and type_+"Collection" not in get_doc(resp).collections:
+            elif type_ in get_dispatch(resp).singles:
                 try:
                     resp.media = hydrafy(resp, crud.get_single(type_, api_name=get_api_name(resp), session=get_session(resp)))
                     return set_response_headers(resp)
@@ -331,30 +326,15 @@ class ItemCollection(object):
 
         :param type_ - Item type
         """
-        if get_authentication(resp):
-            if req.auth is None:
-                return failed_authentication(resp)
-            else:
-                try:
-                    auth = check_authorization(req, get_session(resp))
-                    if auth is False:
-                        return failed_authentication(resp)
-                except Exception as e:
-                    status_code, message = e.get_HTTP()  # type: ignore
-                    resp.media = message
-                    return set_response_headers(resp, status_code=status_code)
-
         endpoint_ = checkEndpoint(resp, "PUT", type_)
         if endpoint_['method']:
             # If endpoint and PUT method is supported in the API
             object_ = req.media
 
-            if type_ in get_doc(resp).collections:
+            if type_ in get_dispatch(resp).collections:
                 # If collection name in document's collections
-                collection = get_doc(resp).collections[type_]["collection"]
-
                 # title of HydraClass object corresponding to collection
-                obj_type = collection.class_.title
+                obj_type = get_dispatch(resp).collections[type_]
 
                 if validObject(object_):
                     # If Item in request's JSON is a valid object
@@ -378,7 +358,7 @@ class ItemCollection(object):
 
                 return set_response_headers(resp, status_code=falcon.HTTP_400)
 
-            elif type_ in get_doc(resp).parsed_classes and type_ + "Collection" not in get_doc(resp).collections:
+            elif type_ in get_dispatch(resp).singles:
                 # If type_ is in parsed_classes but is not a collection
                 obj_type = getType(resp, type_, "PUT")
                 if object_["@type"] == obj_type:
@@ -406,23 +386,10 @@ class ItemCollection(object):
 
         :param type_ - Item type
         """
-        if get_authentication(resp):
-            if req.auth is None:
-                return failed_authentication(resp)
-            else:
-                try:
-                    auth = check_authorization(req, get_session(resp))
-                    if auth is False:
-                        return failed_authentication(resp)
-                except Exception as e:
-                    status_code, message = e.get_HTTP()  # type: ignore
-                    resp.media = message
-                    return set_response_headers(resp, status_code=status_code)
-
         endpoint_ = checkEndpoint(resp, "POST", type_)
         if endpoint_['method']:
             object_ = req.media
-            if type_ in get_doc(resp).parsed_classes and type_ + "Collection" not in get_doc(resp).collections:
+            if type_ in get_dispatch(resp).singles:
                 obj_type = getType(resp, type_, "POST")
                 if validObject(object_):
                     if object_["@type"] == obj_type:
@@ -450,23 +417,10 @@ class ItemCollection(object):
 
         :param type_ - Item type
         """
-        if get_authentication(resp):
-            if req.auth is None:
-                return failed_authentication(resp)
-            else:
-                try:
-                    auth = check_authorization(req, get_session(resp))
-                    if auth is False:
-                        return failed_authentication(resp)
-                except Exception as e:
-                    status_code, message = e.get_HTTP()  # type: ignore
-                    resp.media = message
-                    return set_response_headers(resp, status_code=status_code)
-
         endpoint_ = checkEndpoint(resp, "DELETE", type_)
         if endpoint_['method']:
             # No Delete Operation for collections
-            if type_ in get_doc(resp).parsed_classes and type_ + "Collection" not in get_doc(resp).collections:
+            if type_ in get_dispatch(resp).singles:
                 try:
                     crud.delete_single(type_, session=get_session(resp))
                     response = {"message": "Object successfully deleted"}
@@ -478,33 +432,61 @@ class ItemCollection(object):
                     return set_response_headers(resp, status_code=status_code)
 
 
+class BulkItems(object):
+    """Add many items to a collection with one request."""
+
+    def on_post(self, req, resp, type_: str):
+        """Insert the items of a JSON array or NDJSON body, in one transaction per batch.
+
+        :param type_ - Collection name
+        """
+        if not checkEndpoint(resp, "PUT", type_)['method'] or type_ not in get_dispatch(resp).collections:
+            return set_response_headers(resp, status_code=falcon.HTTP_405)
+
+        added = 0
+        try:
+            objects = iter_objects(req.bounded_stream)
+            for ids in insert_batches(objects, get_session(resp), type_=get_dispatch(resp).collections[type_]):
+                added += len(ids)
+        except ValueError as e:
+            resp.media = {"message": str(e), "added": added}
+            return set_response_headers(resp, status_code=falcon.HTTP_400)
+        except Exception as e:
+            status_code, message = e.get_HTTP()
+            message["added"] = added
+            resp.media = message
+            return set_response_headers(resp, status_code=status_code)
+
+        resp.media = {"message": "%s objects successfully added" % added, "added": added}
+        return set_response_headers(resp, status_code=falcon.HTTP_201)
+
+
 class Contexts(object):
     """Dynamically genereated contexts."""
 
     def on_get(self, req, resp, category: str) -> falcon.Response:
         """Return the context for the specified class."""
-        if "Collection" in category:
-
-            if category in get_doc(resp).collections:
-                resp.media = {"@context": get_doc(resp).collections[category]["context"].generate()} # type: Union[Dict[str,Any],Dict[int,str]]
-                return set_response_headers(resp)
-
-            else:
-                return set_response_headers(resp, status_code= falcon.HTTP_404)
+        contexts = get_documents(resp).contexts
+        if category in contexts:
+            return send_document(req, resp, contexts[category])
 
         else:
-            if category in get_doc(resp).parsed_classes:
-                resp.media = {"@context": get_doc(resp).parsed_classes[category]["context"].generate()}
-                return set_response_headers(resp)
-
-            else:
-                return set_response_headers(resp, status_code=falcon.HTTP_404)
+            return set_response_headers(resp, status_code=falcon.HTTP_404)
 
 
 def app_factory(API_NAME: str, gsm) -> falcon.API:
     """Create an app object."""
 
-    api = falcon.API(middleware=[gsm])
+    # Permission and type checks are answered from tables compiled once from the doc
+    gsm.dispatch = compile_dispatch(gsm.api_doc)
+    # The vocab, EntryPoint and contexts never change, they are encoded only once
+    gsm.documents = render_docs(gsm.api_doc)
+    # The EntryPoint, vocab and contexts are public, every other resource needs credentials
+    auth = Authentication(exempt=(Index, Vocab, Entrypoint, Contexts))
+    api = falcon.API(middleware=[gsm, auth])
+    # Bodies are JSON-LD, read and written like JSON
+    api.req_options.media_handlers['application/ld+json'] = falcon.media.JSONHandler()
+    api.resp_options.media_handlers['application/ld+json'] = falcon.media.JSONHandler()
 
     api.add_route("/"+API_NAME+"/",Index())
     api.add_route("/" + API_NAME + "/vocab", Vocab())
@@ -512,6 +494,7 @@ def app_factory(API_NAME: str, gsm) -> falcon.API:
     api.add_route("/"+API_NAME+"/contexts/EntryPoint.jsonld",Entrypoint())
     api.add_route("/"+API_NAME+"/{type_}", ItemCollection())
     api.add_route("/"+API_NAME+"/{type_}/{id_:int()}", Item())
+    api.add_route("/"+API_NAME+"/{type_}/bulk", BulkItems())
 
     return api
 
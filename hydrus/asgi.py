@@ -0,0 +1,165 @@
+"""ASGI variant of the app, serving the requests of one process on an event loop.
+
+The resources are the ones of hydrus.app: their synchronous code, including every
+crud call, runs inside AsyncSession.run_sync on the request's AsyncSession, so the
+database driver is an async one (see hydrus.data.engine.create_async_db_engine) and a
+request waiting on the database or on a slow client does not block the others.
+"""
+
+import falcon.asgi
+import falcon.media
+from hydrus import app
+from hydrus.dispatch import compile_dispatch
+from hydrus.documents import render_docs
+from hydrus.utils import Getter_setter
+from typing import Any, AsyncIterator, Callable, Iterator
+
+
+async def run_sync(resp, function: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Call a synchronous function with the database session of the request.
+
+    While it runs, get_session(resp) returns the sync Session of the request's
+    AsyncSession, whose queries are awaited on the event loop.
+    """
+    async_session = resp.context['async_session']
+
+    def call(session) -> Any:
+        resp.context['db_session'] = session
+        return function(*args, **kwargs)
+
+    return await async_session.run_sync(call)
+
+
+class AsyncGetter_setter(Getter_setter):
+    """Getter_setter for the ASGI app, db_session must return an AsyncSession."""
+
+    async def process_request(self, req, resp):
+        super().process_request(req, resp)
+        resp.context['async_session'] = resp.context.pop('db_session')
+
+    async def process_response(self, req, resp, resource, req_succeeded):
+        async_session = resp.context.get('async_session')
+        if async_session is None:
+            return
+        if not req_succeeded:
+            await async_session.rollback()
+        if resp.stream is not None:
+            # A streamed body is read from the database while it is sent
+            resp.stream = self._close_after(resp.stream, async_session)
+        else:
+            await async_session.close()
+
+    async def _close_after(self, stream: Iterator[bytes], async_session) -> AsyncIterator[bytes]:
+        """Read the chunks of a synchronous stream on the event loop, then close the session."""
+        try:
+            while True:
+                chunk = await async_session.run_sync(lambda session: next(stream, None))
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            await async_session.close()
+
+
+class Authentication(app.Authentication):
+    """app.Authentication for the ASGI app."""
+
+    async def process_resource(self, req, resp, resource, params):
+        await run_sync(resp, super().process_resource, req, resp, resource, params)
+
+
+class _ReadRequest(object):
+    """A request whose body was already awaited, as the synchronous resources read it."""
+
+    def __init__(self, req: falcon.asgi.Request, media: Any) -> None:
+        """Constructor."""
+        self._req = req
+        self.media = media
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._req, name)
+
+
+async def _read(req: falcon.asgi.Request) -> _ReadRequest:
+    """Await the body of a request."""
+    return _ReadRequest(req, await req.get_media())
+
+
+class Index(app.Index):
+    """Class for the EntryPoint."""
+
+    async def on_get(self, req, resp):
+        super().on_get(req, resp)
+
+
+class Vocab(app.Vocab):
+    """Vocabulary for Hydra."""
+
+    async def on_get(self, req, resp):
+        super().on_get(req, resp)
+
+
+class Entrypoint(app.Entrypoint):
+    """Hydra EntryPoint."""
+
+    async def on_get(self, req, resp):
+        super().on_get(req, resp)
+
+
+class Contexts(app.Contexts):
+    """Dynamically genereated contexts."""
+
+    async def on_get(self, req, resp, category: str):
+        super().on_get(req, resp, category)
+
+
+class Item(app.Item):
+    """Operations on Items, see app.Item."""
+
+    async def on_get(self, req, resp, id_, type_):
+        await run_sync(resp, super().on_get, req, resp, id_, type_)
+
+    async def on_post(self, req, resp, id_: int, type_: str):
+        await run_sync(resp, super().on_post, await _read(req), resp, id_, type_)
+
+    async def on_put(self, req, resp, id_: int, type_: str):
+        await run_sync(resp, super().on_put, await _read(req), resp, id_, type_)
+
+    async def on_delete(self, req, resp, id_: int, type_: str):
+        await run_sync(resp, super().on_delete, req, resp, id_, type_)
+
+
+class ItemCollection(app.ItemCollection):
+    """Operations on collections and non-collection classes, see app.ItemCollection."""
+
+    async def on_get(self, req, resp, type_):
+        await run_sync(resp, super().on_get, req, resp, type_)
+
+    async def on_put(self, req, resp, type_: str):
+        await run_sync(resp, super().on_put, await _read(req), resp, type_)
+
+    async def on_post(self, req, resp, type_: str):
+        await run_sync(resp, super().on_post, await _read(req), resp, type_)
+
+    async def on_delete(self, req, resp, type_: str):
+        await run_sync(resp, super().on_delete, req, resp, type_)
+
+
+def asgi_app_factory(API_NAME: str, gsm: AsyncGetter_setter) -> falcon.asgi.App:
+    """Create an ASGI app object, with the routes of app_factory but the bulk one."""
+
+    gsm.dispatch = compile_dispatch(gsm.api_doc)
+    gsm.documents = render_docs(gsm.api_doc)
+    auth = Authentication(exempt=(Index, Vocab, Entrypoint, Contexts))
+    api = falcon.asgi.App(middleware=[gsm, auth])
+    api.req_options.media_handlers['application/ld+json'] = falcon.media.JSONHandler()
+    api.resp_options.media_handlers['application/ld+json'] = falcon.media.JSONHandler()
+
+    api.add_route("/" + API_NAME + "/", Index())
+    api.add_route("/" + API_NAME + "/vocab", Vocab())
+    api.add_route("/" + API_NAME + "/contexts/{category}" + ".jsonld", Contexts())
+    api.add_route("/" + API_NAME + "/contexts/EntryPoint.jsonld", Entrypoint())
+    api.add_route("/" + API_NAME + "/{type_}", ItemCollection())
+    api.add_route("/" + API_NAME + "/{type_}/{id_:int()}", Item())
+
+    return api
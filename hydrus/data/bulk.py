@@ -0,0 +1,210 @@
+"""Bulk insertion of objects, a batch of objects is written with one statement per table."""
+
+import codecs
+import json
+from hydrus.data.datatypes import encode
+from hydrus.data.db_models import Instance
+from hydrus.data.exceptions import InvalidObject
+from hydrus.data.crud import _set_property_type
+from hydrus.data.schema import Schema, get_schema
+from hydrus.data.store import KINDS, get_store, reserve_ids
+from sqlalchemy.orm.scoping import scoped_session
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional
+
+# Size of the chunks read from a request body
+CHUNK_SIZE = 65536
+
+
+def validate_object(object_: Any, schema: Schema, index: int, type_: Optional[str] = None) -> None:
+    """Check an object and its nested objects only use known classes and properties.
+
+    Raises InvalidObject, ClassNotFound or PropertyNotFound. If type_ is given the
+    object itself must be of that class. Literal values must match the range of
+    their property.
+    """
+    if type(object_) != dict or "@type" not in object_:
+        raise InvalidObject(index, "not an object with a @type")
+    if type_ is not None and object_["@type"] != type_:
+        raise InvalidObject(index, "@type must be %s" % type_)
+    schema.class_id(object_["@type"])
+    for prop_name in object_:
+        if prop_name not in ["@type", "@context"]:
+            property_id = schema.property_(prop_name)[0]
+            value = object_[prop_name]
+            if type(value) == dict:
+                validate_object(value, schema, index)
+            elif str(value) not in schema.class_ids:
+                try:
+                    encode(value, schema.datatypes[property_id])
+                except ValueError:
+                    raise InvalidObject(index, "%s is not a valid %s for %s" % (
+                        value, schema.datatypes[property_id], prop_name))
+
+
+def _instances(object_: Dict[str, Any]) -> int:
+    """Return the number of instances an object is stored as, with the objects nested in it."""
+    return 1 + sum(_instances(value) for value in object_.values() if type(value) == dict)
+
+
+class _Batch(object):
+    """The rows of every table needed to store a batch of objects."""
+
+    def __init__(self, schema: Schema, instance_ids: List[int]) -> None:
+        """Constructor, instance_ids are reserved for the instances of the batch, in order."""
+        self.schema = schema
+        self.rows = dict((name, list()) for name in ["instances"] + list(KINDS)) # type: Dict[str, List[Dict[str, Any]]]
+        self.instance_ids = iter(instance_ids)
+        # The type_ every used property must have, as crud.insert sets it
+        self.property_types = dict() # type: Dict[str, set]
+
+    def _use_property(self, prop_name: str, property_type: str) -> int:
+        """Return the ID of a property and remember the type it is used as."""
+        self.property_types.setdefault(prop_name, set()).add(property_type)
+        return self.schema.properties[prop_name][0]
+
+    def add(self, object_: Dict[str, Any]) -> int:
+        """Add the rows of a validated object, return the ID its instance will get."""
+        instance_id = next(self.instance_ids)
+        self.rows["instances"].append({"id": instance_id, "type_": self.schema.class_ids[object_["@type"]]})
+        for prop_name in object_:
+            if prop_name in ["@type", "@context"]:
+                continue
+            value = object_[prop_name]
+            # Same classification as crud.insert
+            if type(value) == dict:
+                property_id = self._use_property(prop_name, "INSTANCE")
+                self.rows["graphiii"].append({"subject": instance_id, "predicate": property_id,
+                                              "object_": self.add(value)})
+            elif str(value) in self.schema.class_ids:
+                property_id = self._use_property(prop_name, "ABSTRACT")
+                self.rows["graphiac"].append({"subject": instance_id, "predicate": property_id,
+                                              "object_": self.schema.class_ids[str(value)]})
+            else:
+                # The store writes the value to a terminal or inline
+                property_id = self._use_property(prop_name, "INSTANCE")
+                value, number = encode(value, self.schema.datatypes[property_id])
+                self.rows["graphiit"].append({"subject": instance_id, "predicate": property_id,
+                                              "value": value, "number": number})
+        return instance_id
+
+
+def insert_many(objects: List[Dict[str, Any]], session: scoped_session, type_: Optional[str] = None,
+                offset: int = 0) -> List[int]:
+    """Insert a batch of objects in one transaction and return the IDs of their instances.
+
+    The whole batch is validated first, offset is added to the positions reported by
+    InvalidObject. Nested objects are inserted as their own instances, like crud.insert
+    does, and every @id in the objects is ignored.
+    """
+    schema = get_schema(session)
+    for index, object_ in enumerate(objects):
+        validate_object(object_, schema, offset + index, type_)
+
+    batch = _Batch(schema, reserve_ids(session, "instances", sum(_instances(object_) for object_ in objects)))
+    ids = [batch.add(object_) for object_ in objects]
+    for prop_name in batch.property_types:
+        property_id, property_type = schema.properties[prop_name]
+        for new_type in sorted(batch.property_types[prop_name]):
+            # A property used as both kinds fails here and the batch is rolled back
+            _set_property_type(property_id, property_type, new_type, prop_name, session)
+            property_type = new_type
+
+    if batch.rows["instances"]:
+        # Instances are inserted first, so the triples always point to existing rows
+        session.execute(Instance.__table__.insert(), batch.rows["instances"])
+    get_store(session).insert_many(session, batch.rows)
+    session.commit()
+    return ids
+
+
+def insert_batches(objects: Iterable[Any], session: scoped_session, type_: Optional[str] = None,
+                   batch_size: int = 1000) -> Iterator[List[int]]:
+    """Insert objects in batches of batch_size, yielding the IDs of every committed batch."""
+    batch = list() # type: List[Any]
+    offset = 0
+    for object_ in objects:
+        batch.append(object_)
+        if len(batch) == batch_size:
+            yield insert_many(batch, session, type_, offset)
+            offset += len(batch)
+            batch = list()
+    if batch:
+        yield insert_many(batch, session, type_, offset)
+
+
+class _Reader(object):
+    """Buffer of the text read so far from a binary stream."""
+
+    def __init__(self, stream: IO[bytes], chunk_size: int) -> None:
+        """Constructor."""
+        self.stream = stream
+        self.chunk_size = chunk_size
+        # A character may be split between two chunks
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.eof = False
+
+    def more(self) -> bool:
+        """Read the next chunk into the buffer, return False at the end of the stream."""
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        self.eof = not chunk
+        self.buffer += self.utf8.decode(chunk or b"", final=self.eof)
+        return not self.eof
+
+    def peek(self) -> str:
+        """Return the next non whitespace character, or "" at the end of the stream."""
+        self.buffer = self.buffer.lstrip()
+        while not self.buffer and self.more():
+            self.buffer = self.buffer.lstrip()
+        return self.buffer[:1]
+
+    def skip(self) -> str:
+        """Consume and return the next non whitespace character."""
+        char = self.peek()
+        self.buffer = self.buffer[1:]
+        return char
+
+    def value(self) -> Any:
+        """Consume and return the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer)
+            except ValueError:
+                if not self.more():
+                    raise ValueError("Invalid JSON in the request body")
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and self.more():
+                continue
+            self.buffer = self.buffer[end:]
+            return value
+
+
+def iter_objects(stream: IO[bytes], chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    """Decode the values of a JSON array, or of NDJSON lines, while the stream is read.
+
+    Raises ValueError if the body is neither.
+    """
+    reader = _Reader(stream, chunk_size)
+    if reader.peek() != "[":
+        while reader.peek():
+            yield reader.value()
+        return
+
+    reader.skip()
+    if reader.peek() == "]":
+        reader.skip()
+    else:
+        while True:
+            yield reader.value()
+            separator = reader.skip()
+            if separator == "]":
+                break
+            if separator != ",":
+                raise ValueError("Expected , or ] in the JSON array")
+    if reader.peek():
+        raise ValueError("Unexpected data after the JSON array")
@@ -1,246 +1,477 @@
 """Basic CRUD operations for the server."""
 
+import json
+from urllib.parse import urlencode
 from sqlalchemy.orm import with_polymorphic
-from sqlalchemy import exists
-from sqlalchemy.orm.exc import NoResultFound
-from hydrus.data.db_models import (Graph, BaseProperty, RDFClass, Instance,
-                                   Terminal, GraphIAC, GraphIIT, GraphIII)
+from sqlalchemy import exists, and_, select
+from hydrus.data.datatypes import decode, encode
+from hydrus.data.db_models import BaseProperty, Instance
 
-from hydrus.data.exceptions import (ClassNotFound, InstanceExists, PropertyNotFound,
+from hydrus.data.exceptions import (InstanceExists, PropertyNotFound,
                                     NotInstanceProperty, NotAbstractProperty,
-                                    InstanceNotFound)
+                                    InstanceNotFound, InvalidValue)
+from hydrus.data.filters import compile_filters
+from hydrus.data.schema import get_schema, invalidate_schema_on_end
+from hydrus.data.store import KINDS, get_store
 from sqlalchemy.orm.scoping import scoped_session
-from typing import Dict, Optional, Any, List
+from typing import Dict, Optional, Any, List, Iterator, Tuple
 
-triples = with_polymorphic(Graph, '*')
 properties = with_polymorphic(BaseProperty, "*")
 
 
+def _closure(criterion: Any, session: scoped_session) -> Any:
+    """Select the IDs of every Instance matching criterion and of all instances nested under them."""
+    graphiii = get_store(session).edges("graphiii")
+    closure = select([Instance.id.label("id")]).where(criterion).cte(name="closure", recursive=True)
+    closure = closure.union(select([graphiii.c.object_]).where(graphiii.c.subject == closure.c.id))
+    return select([closure.c.id])
+
+
+def _hydrate(criterion: Any, session: scoped_session) -> Dict[int, Dict[str, Any]]:
+    """Load every Instance matching criterion, and all instances nested under them, as dicts.
+
+    The closure of nested instances is computed with a recursive CTE over graphiii and the
+    edges of the whole closure are fetched with one joined query per triple kind, so the
+    number of queries does not depend on the number of properties or the nesting depth.
+    Returns a mapping of instance ID to object; nested objects are shared by reference.
+    """
+    store = get_store(session)
+    graphiac = store.edges("graphiac")
+    graphiii = store.edges("graphiii")
+    terminals = store.terminals()
+    schema = get_schema(session)
+    closure_ids = _closure(criterion, session)
+
+    # Class and property names come from the cached schema, only terminals need a join
+    objects = dict() # type: Dict[int, Dict[str, Any]]
+    for id_, class_id in session.query(Instance.id, Instance.type_).filter(
+            Instance.id.in_(closure_ids)).order_by(Instance.id):
+        objects[id_] = {"@type": schema.class_names.get(class_id)}
+
+    data_IAC = session.query(graphiac.c.subject, graphiac.c.predicate, graphiac.c.object_).filter(
+        graphiac.c.subject.in_(closure_ids))
+    for subject, predicate, class_id in data_IAC:
+        objects[subject][schema.property_names[predicate]] = schema.class_names[class_id]
+
+    data_III = session.query(graphiii.c.subject, graphiii.c.predicate, graphiii.c.object_).filter(
+        graphiii.c.subject.in_(closure_ids))
+    for subject, predicate, object_id in data_III:
+        objects[subject][schema.property_names[predicate]] = objects[object_id]
+
+    data_IIT = session.query(terminals.c.subject, terminals.c.predicate, terminals.c.terminal,
+                             terminals.c.value, terminals.c.number).filter(terminals.c.subject.in_(closure_ids))
+    for subject, predicate, terminal_id, value, number in data_IIT:
+        # If terminal is none
+        objects[subject][schema.property_names[predicate]] = (
+            decode(value, number, schema.datatypes[predicate]) if terminal_id is not None else "")
+
+    return objects
+
+
 def get(id_: int, type_: str, api_name: str, session: scoped_session, recursive: bool = False) -> Dict[str, str]:
     """Retrieve an Instance with given ID from the database [GET]."""
-    object_template = {
-        "@type": "",
-    } # type: Dict[str, Any]
-    try:
-        rdf_class = session.query(RDFClass).filter(
-            RDFClass.name == type_).one()
-    except NoResultFound:
-        raise ClassNotFound(type_=type_)
+    class_id = get_schema(session).class_id(type_)
 
-    try:
-        instance = session.query(Instance).filter(
-            Instance.id == id_, Instance.type_ == rdf_class.id).one()
-    except NoResultFound:
-        raise InstanceNotFound(type_=rdf_class.name, id_=id_)
-
-    data_IAC = session.query(triples).filter(triples.GraphIAC.subject == id_).all()
-
-    data_III = session.query(triples).filter(triples.GraphIII.subject == id_).all()
-
-    data_IIT = session.query(triples).filter(triples.GraphIIT.subject == id_).all()
-
-    for data in data_IAC:
-        prop_name = session.query(properties).filter(properties.id == data.predicate).one().name
-        class_name = session.query(RDFClass).filter(RDFClass.id == data.object_).one().name
-        object_template[prop_name] = class_name
-
-    for data in data_III:
-        prop_name = session.query(properties).filter(properties.id == data.predicate).one().name
-        instance = session.query(Instance).filter(Instance.id == data.object_).one()
-        # Get class name for instance object
-        inst_class_name = session.query(RDFClass).filter(RDFClass.id == instance.type_).one().name
-        # Recursive call should get the instance needed
-        object_ = get(id_=instance.id, type_=inst_class_name, session=session, recursive=True, api_name=api_name)
-        object_template[prop_name] = object_
-
-    for data in data_IIT:
-        prop_name = session.query(properties).filter(properties.id == data.predicate).one().name
-        terminal = session.query(Terminal).filter(Terminal.id == data.object_).one()
-        try:
-            object_template[prop_name] = terminal.value
-        except:
-            # If terminal is none
-            object_template[prop_name] = ""
-    object_template["@type"] = rdf_class.name
+    objects = _hydrate(and_(Instance.id == id_, Instance.type_ == class_id), session)
+    if id_ not in objects:
+        raise InstanceNotFound(type_=type_, id_=id_)
+
+    object_template = objects[id_]
     if not recursive:
         object_template["@id"] = "/"+api_name+"/"+type_+"Collection/"+str(id_)
 
     return object_template
 
 
-def insert(object_: Dict[str, Any], session: scoped_session , id_: Optional[int] =None) -> int:
-    """Insert an object to database [POST] and returns the inserted object."""
-    rdf_class = None
-    instance = None
+def _set_property_type(property_id: int, property_type: str, new_type: str, prop_name: str,
+                       session: scoped_session) -> None:
+    """Promote a Property to an INSTANCE or ABSTRACT property the first time it is used.
+
+    The cached type_ is trusted when it already matches, otherwise the row is only updated
+    if it is still a plain PROPERTY (or another process promoted it the same way). The
+    cached Schema is dropped when the transaction commits or rolls back.
+    """
+    if property_type == new_type:
+        return
+    promoted = session.query(BaseProperty).filter(
+        BaseProperty.id == property_id, BaseProperty.type_.in_(["PROPERTY", new_type])).update(
+        {"type_": new_type}, synchronize_session=False)
+    invalidate_schema_on_end(session)
+    if promoted:
+        return
+    session.close()
+    if new_type == "INSTANCE":
+        raise NotInstanceProperty(type_=prop_name)
+    raise NotAbstractProperty(type_=prop_name)
+
+
+def _encode(prop_name: str, value: Any, datatype_: Optional[str], session: scoped_session) -> Tuple[Any, Optional[float]]:
+    """Return the text and number a literal is stored with, raise InvalidValue if it does not fit its range."""
+    try:
+        return encode(value, datatype_)
+    except ValueError:
+        session.close()
+        raise InvalidValue(prop_name, value, datatype_)
+
 
-    # Check for class in the begging
+def _add_property(instance_id: int, prop_name: str, value: Any, session: scoped_session) -> None:
+    """Add the triple of one property of an object to the session, with the object nested in it."""
+    schema = get_schema(session)
+    store = get_store(session)
     try:
-        rdf_class = session.query(RDFClass).filter(
-            RDFClass.name == object_["@type"]).one()
-    except NoResultFound:
-        raise ClassNotFound(type_=object_["@type"])
+        property_id, property_type = schema.property_(prop_name)
+    except PropertyNotFound:
+        # Adds new Property
+        session.close()
+        raise
+
+    # For insertion in III
+    if type(value) == dict:
+        nested_id = _insert(value, session=session)
+        _set_property_type(property_id, property_type, "INSTANCE", prop_name, session)
+        store.add(session, "graphiii", instance_id, property_id, nested_id)
+
+    # For insertion in IAC
+    elif str(value) in schema.class_ids:
+        _set_property_type(property_id, property_type, "ABSTRACT", prop_name, session)
+        store.add(session, "graphiac", instance_id, property_id, schema.class_ids[str(value)])
+
+    # For insertion in IIT
+    else:
+        value, number = _encode(prop_name, value, schema.datatypes[property_id], session)
+        _set_property_type(property_id, property_type, "INSTANCE", prop_name, session)
+        # Add things directly to session, if anything fails whole transaction is aborted
+        store.add_terminal(session, instance_id, property_id, value, number)
+
+
+def _insert(object_: Dict[str, Any], session: scoped_session, id_: Optional[int] = None) -> int:
+    """Add an object and the objects nested in it to the session, return the ID of its instance."""
+    instance = None
+    class_id = get_schema(session).class_id(object_["@type"])
 
     if id_ is not None:
         if session.query(exists().where(Instance.id == id_)).scalar():
-            raise InstanceExists(type_=rdf_class.name, id_=id_)
+            raise InstanceExists(type_=object_["@type"], id_=id_)
         else:
-            instance = Instance(id=id_, type_=rdf_class.id)
+            instance = Instance(id=id_, type_=class_id)
     else:
-        instance = Instance(type_=rdf_class.id)
+        instance = Instance(type_=class_id)
     session.add(instance)
     session.flush()
 
     for prop_name in object_:
         if prop_name not in ["@type", "@context"]:
-            try:
-                property_ = session.query(properties).filter(
-                    properties.name == prop_name).one()
-            except NoResultFound:
-                # Adds new Property
-                session.close()
-                raise PropertyNotFound(type_=prop_name)
-
-            # For insertion in III
-            if type(object_[prop_name]) == dict:
-                instance_id = insert(object_[prop_name], session=session)
-                instance_object = session.query(Instance).filter(Instance.id == instance_id).one()
-
-                if property_.type_ == "PROPERTY" or property_.type_ == "INSTANCE":
-                    property_.type_ = "INSTANCE"
-                    session.add(property_)
-                    triple = GraphIII(subject=instance.id, predicate=property_.id, object_=instance_object.id)
-                    session.add(triple)
-                else:
-                    session.close()
-                    raise NotInstanceProperty(type_=prop_name)
-
-            # For insertion in IAC
-            elif session.query(exists().where(RDFClass.name == str(object_[prop_name]))).scalar():
-                if property_.type_ == "PROPERTY" or property_.type_ == "ABSTRACT":
-                    property_.type_ = "ABSTRACT"
-                    session.add(property_)
-                    class_ = session.query(RDFClass).filter(RDFClass.name == object_[prop_name]).one()
-                    triple = GraphIAC(subject=instance.id, predicate=property_.id, object_=class_.id)
-                    session.add(triple)
-                else:
-                    session.close()
-                    raise NotAbstractProperty(type_=prop_name)
-
-            # For insertion in IIT
-            else:
-                terminal = Terminal(value=object_[prop_name])
-                session.add(terminal)
-                session.flush()     # Assigns ID without committing
-
-                if property_.type_ == "PROPERTY" or property_.type_ == "INSTANCE":
-                    property_.type_ = "INSTANCE"
-                    session.add(property_)
-                    triple = GraphIIT(subject=instance.id, predicate=property_.id, object_=terminal.id)
-                    # Add things directly to session, if anything fails whole transaction is aborted
-                    session.add(triple)
-                else:
-                    session.close()
-                    raise NotInstanceProperty(type_=prop_name)
+            _add_property(instance.id, prop_name, object_[prop_name], session)
+    return instance.id
+
+
+def insert(object_: Dict[str, Any], session: scoped_session , id_: Optional[int] =None) -> int:
+    """Insert an object to database [POST] and returns the inserted object.
 
+    Nested objects are inserted as their own instances, in the same transaction.
+    """
+    instance_id = _insert(object_, session, id_)
     session.commit()
-    return instance.id
+    return instance_id
+
+
+def _delete_instances(ids: List[int], session: scoped_session) -> None:
+    """Delete instances and all their triples with one statement per table, without committing."""
+    store = get_store(session)
+    # Terminals of the instances are deleted with their graphiit triples
+    for kind in KINDS:
+        store.delete(session, kind, ids)
+    session.query(Instance).filter(Instance.id.in_(ids)).delete(synchronize_session=False)
 
 
 def delete(id_:int, type_:str, session:scoped_session) -> None:
-    """Delete an Instance and all its relations from DB given id [DELETE]."""
-    try:
-        rdf_class = session.query(RDFClass).filter(RDFClass.name == type_).one()
-    except NoResultFound:
-        print(type_)
-        raise ClassNotFound(type_=type_)
-    try:
-        instance = session.query(Instance).filter(
-            Instance.id == id_ and type_ == rdf_class.id).one()
-    except NoResultFound:
-        raise InstanceNotFound(type_=rdf_class.name, id_=id_)
-
-    data_IIT = session.query(triples).filter(triples.GraphIIT.subject == id_).all()
-    data_IAC = session.query(triples).filter(triples.GraphIAC.subject == id_).all()
-    data_III = session.query(triples).filter(triples.GraphIII.subject == id_).all()
-
-    data = data_III + data_IIT + data_IAC
-    for item in data:
-        session.delete(item)
-
-    for data in data_IIT:
-        terminal = session.query(Terminal).filter(Terminal.id == data.object_).one()
-        session.delete(terminal)
-
-    for data in data_III:
-        III_instance = session.query(Instance).filter(Instance.id == data.object_).one()
-        III_instance_type = session.query(RDFClass).filter(RDFClass.id == III_instance.type_).one()
-        # Get the III object type_
-        delete(III_instance.id, III_instance_type.name, session=session)
-
-    session.delete(instance)
+    """Delete an Instance and all its relations from DB given id [DELETE].
+
+    The instances nested under it are found with the recursive query of _closure and
+    deleted with it in one transaction, so the number of statements does not depend
+    on the size or depth of the object.
+    """
+    class_id = get_schema(session).class_id(type_)
+    if not session.query(exists().where(and_(Instance.id == id_, Instance.type_ == class_id))).scalar():
+        raise InstanceNotFound(type_=type_, id_=id_)
+
+    closure_ids = [row.id for row in session.execute(_closure(Instance.id == id_, session))]
+    _delete_instances(closure_ids, session)
     session.commit()
 
 
+def _literal_key(value: Any, number: Optional[float]) -> Tuple[Optional[str], Optional[float]]:
+    """Return a stored or encoded literal in a form that compares equal when they match."""
+    return (None if value is None else str(value)), number
+
+
+def _stored_triples(id_: int, session: scoped_session) -> Dict[int, List[Tuple[str, Any, Any]]]:
+    """Return the triples of an Instance by predicate, as (kind, object_, literal) tuples.
+
+    object_ is the class or nested instance of graphiac and graphiii triples, literal
+    the _literal_key of graphiit triples.
+    """
+    store = get_store(session)
+    triples = dict() # type: Dict[int, List[Tuple[str, Any, Any]]]
+    for kind in ["graphiac", "graphiii"]:
+        edges = store.edges(kind)
+        for predicate, object_ in session.query(edges.c.predicate, edges.c.object_).filter(edges.c.subject == id_):
+            triples.setdefault(predicate, list()).append((kind, object_, None))
+    terminals = store.terminals()
+    for predicate, value, number in session.query(terminals.c.predicate, terminals.c.value,
+                                                  terminals.c.number).filter(terminals.c.subject == id_):
+        triples.setdefault(predicate, list()).append(("graphiit", None, _literal_key(value, number)))
+    return triples
+
+
+def _remove_triples(id_: int, property_id: int, triples: List[Tuple[str, Any, Any]], session: scoped_session) -> None:
+    """Delete the triples of one property of an Instance, with the objects nested in them."""
+    store = get_store(session)
+    nested_ids = [object_ for kind, object_, _ in triples if kind == "graphiii"]
+    closure_ids = list() # type: List[int]
+    if nested_ids:
+        closure_ids = [row.id for row in session.execute(_closure(Instance.id.in_(nested_ids), session))]
+    for kind in sorted(set(kind for kind, _, _ in triples)):
+        store.delete(session, kind, [id_], property_id)
+    if closure_ids:
+        _delete_instances(closure_ids, session)
+
+
+def _update(id_: int, object_: Dict[str, Any], session: scoped_session) -> None:
+    """Rewrite the triples of an Instance that differ from object_, without committing.
+
+    A nested object that replaces a nested object is updated the same way, so its
+    instance keeps its ID.
+    """
+    schema = get_schema(session)
+    class_id = schema.class_id(object_["@type"])
+    if session.query(Instance.type_).filter(Instance.id == id_).scalar() != class_id:
+        session.query(Instance).filter(Instance.id == id_).update({"type_": class_id}, synchronize_session=False)
+
+    stored = _stored_triples(id_, session)
+    for prop_name in object_:
+        if prop_name in ["@type", "@context"]:
+            continue
+        try:
+            property_id = schema.property_(prop_name)[0]
+        except PropertyNotFound:
+            session.close()
+            raise
+        value = object_[prop_name]
+        triples = stored.pop(property_id, list())
+        if len(triples) == 1:
+            kind, stored_object, literal = triples[0]
+            if type(value) == dict:
+                if kind == "graphiii":
+                    _update(stored_object, value, session)
+                    continue
+            elif str(value) in schema.class_ids:
+                if kind == "graphiac" and stored_object == schema.class_ids[str(value)]:
+                    continue
+            elif kind == "graphiit" and literal == _literal_key(
+                    *_encode(prop_name, value, schema.datatypes[property_id], session)):
+                continue
+        _remove_triples(id_, property_id, triples, session)
+        _add_property(id_, prop_name, value, session)
+
+    # Properties missing from the object are removed
+    for property_id in sorted(stored):
+        _remove_triples(id_, property_id, stored[property_id], session)
+
+
 def update(id_: int, type_: str, object_: Dict[str,str], session: scoped_session, api_name:str) -> int:
-    """Update an object properties based on the given object [PUT]."""
-    # Keep the object as fail safe
-    instance = get(id_=id_, type_=type_, session=session, api_name=api_name)
-    instance.pop("@id")
-
-    # Delete the old object
-    delete(id_=id_, type_=type_, session=session)
-    # Try inserting new object
+    """Update an object properties based on the given object [PUT].
+
+    The object is compared with the stored triples and only the ones that changed are
+    rewritten, in one transaction that is rolled back if the object is invalid.
+    """
+    class_id = get_schema(session).class_id(type_)
+    if not session.query(exists().where(and_(Instance.id == id_, Instance.type_ == class_id))).scalar():
+        raise InstanceNotFound(type_=type_, id_=id_)
     try:
-        insert(object_=object_, id_=id_, session=session)
-    except Exception as e:
-        # Put old object back
-        insert(object_=instance, id_=id_, session=session)
-        raise e
-
-    get(id_=id_, type_=type_, session=session, api_name=api_name)
+        _update(id_, object_, session)
+    except Exception:
+        session.rollback()
+        raise
+    session.commit()
     return id_
 
 
-def get_collection(API_NAME: str, type_: str, session: scoped_session) -> Dict[str, Any]:
-    """Retrieve a type of collection from the database."""
+def _page_link(collection_id: str, page_size: int, expand: bool, filters: Dict[str, Any], **cursor: int) -> str:
+    """Return the IRI of a collection page, keeping the filters of the request."""
+    query = "pageSize=" + str(page_size)
+    for key in sorted(cursor):
+        query += "&" + key + "=" + str(cursor[key])
+    if expand:
+        query += "&expand=members"
+    if filters:
+        query += "&" + urlencode(sorted(filters.items()), doseq=True)
+    return collection_id.rstrip("/") + "?" + query
+
+
+def _get_page(members: Any, collection_id: str, session: scoped_session, expand: bool, page_size: int,
+              after: Optional[int], before: Optional[int], filters: Dict[str, Any]) -> Dict[str, Any]:
+    """Select one page of member IDs with an id-cursor and build its PartialCollectionView.
+
+    A page is fetched as page_size + 1 rows ordered by ID after/before the cursor, the
+    extra row telling whether there is a page beyond it, so the cost of a page does not
+    depend on the size of the collection.
+    """
+    ids = session.query(Instance.id).filter(members)
+    if before is not None:
+        rows = ids.filter(Instance.id < before).order_by(Instance.id.desc()).limit(page_size + 1).all()
+        has_previous = len(rows) > page_size
+        page = [row.id for row in reversed(rows[:page_size])]
+        has_next = session.query(ids.filter(Instance.id >= before).exists()).scalar()
+    else:
+        if after is not None:
+            ids_after = ids.filter(Instance.id > after)
+        else:
+            ids_after = ids
+        rows = ids_after.order_by(Instance.id).limit(page_size + 1).all()
+        has_next = len(rows) > page_size
+        page = [row.id for row in rows[:page_size]]
+        has_previous = after is not None and session.query(ids.filter(Instance.id <= after).exists()).scalar()
+
+    if before is not None:
+        current = _page_link(collection_id, page_size, expand, filters, before=before)
+    elif after is not None:
+        current = _page_link(collection_id, page_size, expand, filters, after=after)
+    else:
+        current = _page_link(collection_id, page_size, expand, filters)
+    view = {
+        "@id": current,
+        "@type": "PartialCollectionView",
+        "first": _page_link(collection_id, page_size, expand, filters),
+    } # type: Dict[str, Any]
+    if has_previous and page:
+        view["previous"] = _page_link(collection_id, page_size, expand, filters, before=page[0])
+    if has_next and page:
+        view["next"] = _page_link(collection_id, page_size, expand, filters, after=page[-1])
+        last_id = session.query(Instance.id).filter(members).order_by(Instance.id.desc()).limit(1).scalar()
+        view["last"] = _page_link(collection_id, page_size, expand, filters, before=last_id + 1)
+    else:
+        view["last"] = current
+    return {"ids": page, "view": view}
+
+
+def get_collection(API_NAME: str, type_: str, session: scoped_session, expand: bool = False,
+                   page_size: Optional[int] = None, after: Optional[int] = None,
+                   before: Optional[int] = None, filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Retrieve a type of collection from the database.
+
+    With expand=True members are returned as full objects instead of @id/@type stubs,
+    hydrated for the whole page at once by _hydrate.
+    With page_size set only one page of members is returned, starting after the member
+    with ID after (or ending before the member with ID before), together with a Hydra
+    PartialCollectionView linking to the first, previous, next and last pages.
+    Only members matching every filter are returned, see hydrus.data.filters.
+    """
     collection_template = {
         "@id": "/"+API_NAME+"/" + type_ + "Collection/",
         "@context": None,
         "@type": type_ + "Collection",
         "members": list()
     } # type: Dict[str, Any]
-    try:
-        rdf_class = session.query(RDFClass).filter(
-            RDFClass.name == type_).one()
-    except NoResultFound:
-        raise ClassNotFound(type_=type_)
+    class_id = get_schema(session).class_id(type_)
+    filters = filters or dict()
+    members = and_(Instance.type_ == class_id, *compile_filters(filters, session))
+
+    if page_size is not None:
+        page = _get_page(members, collection_template["@id"], session, expand, page_size, after, before, filters)
+        collection_template["view"] = page["view"]
+        member_ids = page["ids"]
+        criterion = Instance.id.in_(member_ids)
+    else:
+        member_ids = [row.id for row in session.query(Instance.id).filter(members).order_by(Instance.id)]
+        criterion = members
 
-    try:
-        instances = session.query(Instance).filter(Instance.type_ == rdf_class.id).all()
-    except NoResultFound:
-        instances = list()
+    objects = dict() # type: Dict[int, Dict[str, Any]]
+    if expand and member_ids:
+        objects = _hydrate(criterion, session)
 
-    for instance_ in instances:
+    for id_ in member_ids:
         object_template = {
-            "@id": "/"+API_NAME+"/" + type_ + "Collection/" + str(instance_.id),
+            "@id": "/"+API_NAME+"/" + type_ + "Collection/" + str(id_),
             "@type": type_
         }
+        if expand:
+            object_template.update(objects[id_])
         collection_template["members"].append(object_template)
     return collection_template
 
 
+def _encode_members(collection_id: str, type_: str, ids: List[int], session: scoped_session, expand: bool) -> str:
+    """Return the JSON encoded members with the given IDs, separated by commas."""
+    objects = dict() # type: Dict[int, Dict[str, Any]]
+    if expand:
+        objects = _hydrate(Instance.id.in_(ids), session)
+    members = list()
+    for id_ in ids:
+        object_template = {
+            "@id": collection_id + str(id_),
+            "@type": type_
+        }
+        if expand:
+            object_template.update(objects[id_])
+        members.append(json.dumps(object_template))
+    return ", ".join(members)
+
+
+def _stream_members(API_NAME: str, type_: str, members: Any, session: scoped_session, expand: bool,
+                    context: Optional[str], batch_size: int) -> Iterator[bytes]:
+    """Write a collection as JSON-LD, one batch of members at a time."""
+    collection_id = "/"+API_NAME+"/" + type_ + "Collection/"
+    head = json.dumps({"@id": collection_id, "@context": context, "@type": type_ + "Collection"})
+    yield (head[:-1] + ', "members": [').encode("utf-8")
+
+    # Member IDs are read through a server-side cursor, members are hydrated one batch at a time
+    rows = session.query(Instance.id).filter(members).order_by(Instance.id).yield_per(batch_size)
+    separator = ""
+    batch = list() # type: List[int]
+    for row in rows:
+        batch.append(row.id)
+        if len(batch) == batch_size:
+            yield (separator + _encode_members(collection_id, type_, batch, session, expand)).encode("utf-8")
+            separator = ", "
+            batch = list()
+    if batch:
+        yield (separator + _encode_members(collection_id, type_, batch, session, expand)).encode("utf-8")
+    yield b"]}"
+
+
+def stream_collection(API_NAME: str, type_: str, session: scoped_session, expand: bool = False,
+                      context: Optional[str] = None, batch_size: int = 500,
+                      filters: Optional[Dict[str, Any]] = None) -> Iterator[bytes]:
+    """Retrieve a whole collection from the database as an iterator of JSON-LD encoded chunks.
+
+    Unlike get_collection the members are never held in memory all at once, the first
+    chunk is produced before any member has been read. Invalid filters raise before
+    the iterator is returned.
+    """
+    class_id = get_schema(session).class_id(type_)
+    members = and_(Instance.type_ == class_id, *compile_filters(filters or dict(), session))
+    return _stream_members(API_NAME, type_, members, session, expand, context, batch_size)
+
+
+def _single_id(class_id: int, session: scoped_session) -> Optional[int]:
+    """Return the ID of the instance of a class with single objects, None if there is none.
+
+    If stale duplicates exist the newest one is used, found through ix_instances_type_id
+    without reading the others.
+    """
+    return session.query(Instance.id).filter(Instance.type_ == class_id).order_by(
+        Instance.id.desc()).limit(1).scalar()
+
+
 def get_single(type_: str, api_name: str, session: scoped_session) -> Dict[str, Any]:
     """Get instance of classes with single objects."""
-    try:
-        rdf_class = session.query(RDFClass).filter(RDFClass.name == type_).one()
-    except NoResultFound:
-        raise ClassNotFound(type_=type_)
+    class_id = get_schema(session).class_id(type_)
 
-    try:
-        instance = session.query(Instance).filter(Instance.type_ == rdf_class.id).all()[-1]
-    except (NoResultFound, IndexError, ValueError):
-        raise InstanceNotFound(type_=rdf_class.name)
-    object_ = get(instance.id, rdf_class.name, session=session, api_name=api_name)
+    instance_id = _single_id(class_id, session)
+    if instance_id is None:
+        raise InstanceNotFound(type_=type_)
+    object_ = get(instance_id, type_, session=session, api_name=api_name)
 
     object_["@id"] = "/"+api_name+"/"+type_
 
@@ -249,45 +480,31 @@ def get_single(type_: str, api_name: str, session: scoped_session) -> Dict[str,
 
 def insert_single(object_: Dict[str, Any], session: scoped_session) -> Any:
     """Insert instance of classes with single objects."""
-    try:
-        rdf_class = session.query(RDFClass).filter(RDFClass.name == object_["@type"]).one()
-    except NoResultFound:
-        raise ClassNotFound(type_=object_["@type"])
+    class_id = get_schema(session).class_id(object_["@type"])
 
-    try:
-        session.query(Instance).filter(Instance.type_ == rdf_class.id).all()[-1]
-    except (NoResultFound, IndexError, ValueError):
+    if _single_id(class_id, session) is None:
         return insert(object_, session=session)
 
-    raise InstanceExists(type_=rdf_class.name)
+    raise InstanceExists(type_=object_["@type"])
 
 
 def update_single(object_: Dict[str, Any], session: scoped_session, api_name: str) -> int:
     """Update instance of classes with single objects."""
-    try:
-        rdf_class = session.query(RDFClass).filter(RDFClass.name == object_["@type"]).one()
-    except NoResultFound:
-        print("Class not found in update_single")
-        raise ClassNotFound(type_=object_["@type"])
+    class_id = get_schema(session).class_id(object_["@type"])
 
-    try:
-        instance = session.query(Instance).filter(Instance.type_ == rdf_class.id).all()[-1]
-    except (NoResultFound, IndexError, ValueError):
-        raise InstanceNotFound(type_=rdf_class.name)
+    instance_id = _single_id(class_id, session)
+    if instance_id is None:
+        raise InstanceNotFound(type_=object_["@type"])
 
-    return update(id_=instance.id, type_=object_["@type"], object_=object_, session=session, api_name=api_name)
+    return update(id_=instance_id, type_=object_["@type"], object_=object_, session=session, api_name=api_name)
 
 
 def delete_single(type_: str, session: scoped_session) -> None:
     """Delete instance of classes with single objects."""
-    try:
-        rdf_class = session.query(RDFClass).filter(RDFClass.name == type_).one()
-    except NoResultFound:
-        raise ClassNotFound(type_=type_)
+    class_id = get_schema(session).class_id(type_)
 
-    try:
-        instance = session.query(Instance).filter(Instance.type_ == rdf_class.id).all()[-1]
-    except (NoResultFound, IndexError, ValueError):
-        raise InstanceNotFound(type_=rdf_class.name)
+    instance_id = _single_id(class_id, session)
+    if instance_id is None:
+        raise InstanceNotFound(type_=type_)
 
-    return delete(instance.id, type_, session=session)
\ No newline at end of file
+    return delete(instance_id, type_, session=session)
\ No newline at end of file
@@ -0,0 +1,118 @@
+"""Typed literal values, derived from the range of a Hydra property.
+
+A literal of a property whose range is a numeric, boolean or date XSD datatype is
+stored with a number besides its text, so it can be compared and indexed as one.
+Literals of other properties are stored as given and have no number.
+"""
+
+import math
+from datetime import datetime, timezone
+from typing import Any, Optional, Tuple
+
+XSD = "http://www.w3.org/2001/XMLSchema#"
+
+# XSD datatypes stored with a number, by how the number is read back
+DATATYPES = {
+    "integer": "integer", "int": "integer", "long": "integer", "short": "integer", "byte": "integer",
+    "nonNegativeInteger": "integer", "positiveInteger": "integer", "nonPositiveInteger": "integer",
+    "negativeInteger": "integer", "unsignedLong": "integer", "unsignedInt": "integer",
+    "unsignedShort": "integer", "unsignedByte": "integer",
+    "decimal": "float", "float": "float", "double": "float",
+    "boolean": "boolean",
+    "dateTime": "dateTime", "date": "dateTime",
+}
+
+
+def datatype(range_: Optional[str]) -> Optional[str]:
+    """Return integer, float, boolean or dateTime for a typed range, None if values are text."""
+    if not range_:
+        return None
+    for prefix in [XSD, "xsd:"]:
+        if range_.startswith(prefix):
+            return DATATYPES.get(range_[len(prefix):])
+    return None
+
+
+def _scalar(value: Any) -> None:
+    """Raise ValueError unless a value is a number or a string, like null or a list."""
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(value)
+
+
+def _float(value: Any) -> float:
+    """Return a number as a float, raise ValueError if it is beyond the range of floats."""
+    try:
+        return float(value)
+    except OverflowError:
+        raise ValueError(value)
+
+
+def _integer(value: Any) -> int:
+    """Return the exact integer of a value, raise ValueError if it is not one or can not be indexed."""
+    _scalar(value)
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError(value)
+    integer = int(value)
+    # The number column holds it as a float
+    _float(integer)
+    return integer
+
+
+def to_number(value: Any, datatype_: str) -> float:
+    """Return the number a value of a datatype is stored and compared with.
+
+    dateTime values are ISO 8601 strings stored as POSIX timestamps, without a time
+    zone they are taken as UTC. Integers beyond 2^53 are rounded to the nearest float,
+    their exact value is kept in the text. Raises ValueError for a value the datatype
+    can not hold.
+    """
+    if datatype_ == "boolean":
+        if isinstance(value, bool):
+            return float(value)
+        if str(value).lower() in ["true", "1"]:
+            return 1.0
+        if str(value).lower() in ["false", "0"]:
+            return 0.0
+        raise ValueError(value)
+    if datatype_ == "dateTime":
+        moment = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        return moment.timestamp()
+    if datatype_ == "integer":
+        return float(_integer(value))
+    _scalar(value)
+    number = _float(value)
+    if not math.isfinite(number):
+        raise ValueError(value)
+    return number
+
+
+def encode(value: Any, datatype_: Optional[str]) -> Tuple[Any, Optional[float]]:
+    """Return the text and the number a value is stored with."""
+    if datatype_ is None:
+        return value, None
+    if datatype_ == "integer":
+        integer = _integer(value)
+        return str(integer), float(integer)
+    number = to_number(value, datatype_)
+    if datatype_ == "float":
+        return repr(number), number
+    if datatype_ == "boolean":
+        return "true" if number else "false", number
+    return str(value), number
+
+
+def decode(value: Any, number: Optional[float], datatype_: Optional[str]) -> Any:
+    """Return the value of a literal read back, typed by its datatype.
+
+    Literals stored before their property had a range have no number and keep their text.
+    """
+    if number is None or datatype_ is None or datatype_ == "dateTime":
+        return value
+    if datatype_ == "integer":
+        # The text is exact, the number may be rounded
+        return int(value)
+    if datatype_ == "boolean":
+        return bool(number)
+    return number
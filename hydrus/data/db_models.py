@@ -1,13 +1,11 @@
 """Models for Hydra Classes."""
 
-from sqlalchemy import create_engine, ForeignKey
+from sqlalchemy import create_engine, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Float, Integer, String
 from typing import Any
 # from hydrus.settings import DB_URL
 
-engine = create_engine('sqlite:///database.db')
-
 Base = declarative_base() # type: Any
 
 
@@ -36,6 +34,9 @@ class Instance(Base):
     id = Column(Integer, primary_key=True)
     type_ = Column(Integer, ForeignKey("classes.id"), nullable=True)
 
+    # Collections are read as the instances of one class in ID order
+    __table_args__ = (Index("ix_instances_type_id", "type_", "id"),)
+
 
 class BaseProperty(Base):
     """Model for Basic Property."""
@@ -45,6 +46,8 @@ class BaseProperty(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String, unique=True, nullable=False)
     type_ = Column(String)
+    # XSD datatype of the values, from the range in the API Documentation
+    range_ = Column(String)
 
     __mapper_args__ = {
         'polymorphic_on': type_,
@@ -99,6 +102,10 @@ class Terminal(Base):
     id = Column(Integer, primary_key=True)
     value = Column(String)
     unit = Column(String)
+    # The value as a number if the range of its property is typed, see hydrus.data.datatypes
+    number = Column(Float)
+
+    __table_args__ = (Index("ix_terminals_number", "number"),)
 
     def __repr__(self) -> str:
         """Verbose object name."""
@@ -150,6 +157,11 @@ class GraphIAC(Graph):
         'polymorphic_identity': 'graphiac',
     }
 
+    __table_args__ = (
+        Index("ix_graphiac_subject_predicate", "subject", "predicate"),
+        Index("ix_graphiac_object", "object_"),
+    )
+
     def __repr__(self) -> str:
         """Verbose object name."""
         return "<subject='%s', predicate='%s', object_='%s'>" % (self.subject, self.predicate, self.object_)
@@ -168,6 +180,11 @@ class GraphIII(Graph):
         'polymorphic_identity': 'graphiii',
     }
 
+    __table_args__ = (
+        Index("ix_graphiii_subject_predicate", "subject", "predicate"),
+        Index("ix_graphiii_object", "object_"),
+    )
+
     def __repr__(self) -> str:
         """Verbose object name."""
         return "<subject='%s', predicate='%s', object_='%s'>" % (self.subject, self.predicate, self.object_)
@@ -181,16 +198,63 @@ class GraphIIT(Graph):
     subject = Column(Integer, ForeignKey("instances.id"))
     predicate = Column(Integer, ForeignKey("property.id"))
     object_ = Column(Integer, ForeignKey("terminals.id"))
+    # The literal itself when terminals are stored inline, object_ is NULL then
+    value = Column(String)
+    number = Column(Float)
 
     __mapper_args__ = {
         'polymorphic_identity': 'graphiit',
     }
 
+    __table_args__ = (
+        Index("ix_graphiit_subject_predicate", "subject", "predicate"),
+        Index("ix_graphiit_object", "object_"),
+        Index("ix_graphiit_predicate_number", "predicate", "number"),
+    )
+
     def __repr__(self) -> str:
         """Verbose object name."""
         return "<subject='%s', predicate='%s', object_='%s'>" % (self.subject, self.predicate, self.object_)
 
 
+class Triple(Base):
+    """Model for the single table layout, where every Instance triple is one row.
+    kind is the name of the Graph table the triple would be stored in by the joined layout,
+    object_ is an Instance, RDFClass or Terminal ID depending on it, value and number hold the
+    literal of graphiit triples when terminals are stored inline.
+    """
+
+    __tablename__ = "triples"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(8), nullable=False)
+    subject = Column(Integer, ForeignKey("instances.id"), nullable=False)
+    predicate = Column(Integer, ForeignKey("property.id"), nullable=False)
+    object_ = Column(Integer)
+    value = Column(String)
+    number = Column(Float)
+
+    __table_args__ = (
+        Index("ix_triples_kind_subject_predicate", "kind", "subject", "predicate"),
+        Index("ix_triples_kind_object", "kind", "object_"),
+        Index("ix_triples_kind_predicate_number", "kind", "predicate", "number"),
+    )
+
+    def __repr__(self) -> str:
+        """Verbose object name."""
+        return "<kind='%s', subject='%s', predicate='%s', object_='%s'>" % (self.kind, self.subject,
+                                                                           self.predicate, self.object_)
+
+
+class Setting(Base):
+    """Model for the settings recorded in a database, like its storage layout, as name/value pairs."""
+
+    __tablename__ = "settings"
+
+    name = Column(String, primary_key=True)
+    value = Column(String, nullable=False)
+
+
 class User(Base):
     """Model for a user that stores the ID, paraphrase and a nonce."""
 
@@ -202,5 +266,5 @@ class User(Base):
 
 if __name__ == "__main__":
     print("Creating models....")
-    Base.metadata.create_all(engine)
+    Base.metadata.create_all(create_engine('sqlite:///database.db'))
     print("Done")
\ No newline at end of file
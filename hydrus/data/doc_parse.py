@@ -3,6 +3,7 @@
 from sqlalchemy import exists
 
 from hydrus.data.db_models import RDFClass, BaseProperty
+from hydrus.data.schema import invalidate_schema
 from typing import Any, Dict, List, Set, Optional
 from sqlalchemy.orm.scoping import scoped_session
 # from hydrus.tests.example_doc import doc_gen
@@ -30,6 +31,22 @@ def get_all_properties(classes: List[Dict[str, Any]]) -> Set[str]:
     return set(prop_names)
 
 
+def get_property_ranges(classes: List[Dict[str, Any]]) -> Dict[str, str]:
+    """Get the range of every property whose definition in the APIDocumentation has one.
+
+    The range is read from the supportedProperty, as HydraClassProp writes it, or from
+    its property when that is an object.
+    """
+    ranges = dict() # type: Dict[str, str]
+    for class_ in classes:
+        for prop in class_["supportedProperty"]:
+            if "range" in prop:
+                ranges[prop["title"]] = prop["range"]
+            elif isinstance(prop["property"], dict) and "range" in prop["property"]:
+                ranges[prop["title"]] = prop["property"]["range"]
+    return ranges
+
+
 def insert_classes(classes: List[Dict[str, Any]], session: scoped_session) -> Optional[Any]:
     """Insert all the classes as defined in the APIDocumentation into DB."""
     # print(session.query(exists().where(RDFClass.name == "Datastream")).scalar())
@@ -43,15 +60,26 @@ def insert_classes(classes: List[Dict[str, Any]], session: scoped_session) -> Op
     # print(class_list)
     session.add_all(class_list)
     session.commit()
+    invalidate_schema(session)
     return None
 
 
-def insert_properties(properties: Set[str], session: scoped_session) -> Optional[Any]:
-    """Insert all the properties as defined in the APIDocumentation into DB."""
-    prop_list = [BaseProperty(name=prop) for prop in properties
+def insert_properties(properties: Set[str], session: scoped_session,
+                      ranges: Optional[Dict[str, str]] = None) -> Optional[Any]:
+    """Insert all the properties as defined in the APIDocumentation into DB.
+
+    ranges maps property names to their range, see get_property_ranges; it is also
+    applied to properties that already exist.
+    """
+    ranges = ranges or dict()
+    prop_list = [BaseProperty(name=prop, range_=ranges.get(prop)) for prop in properties
                  if not session.query(exists().where(BaseProperty.name == prop)).scalar()]
     session.add_all(prop_list)
+    for prop in ranges:
+        session.query(BaseProperty).filter(BaseProperty.name == prop).update(
+            {"range_": ranges[prop]}, synchronize_session=False)
     session.commit()
+    invalidate_schema(session)
     return None
 
 
@@ -0,0 +1,162 @@
+"""Database engines with a bounded connection pool, pool metrics and SQLite pragmas."""
+
+import threading
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from typing import Any, Dict, Optional
+
+# Async drivers used by create_async_db_engine for URLs that do not name one
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg", "mysql": "aiomysql"}
+
+# Values of the SQLite pragmas set by create_db_engine
+JOURNAL_MODES = ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF")
+SYNCHRONOUS = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+# Pragmas set on every SQLite connection by the profiles of create_db_engine. tuned
+# commits to a write-ahead log synced at checkpoints instead of every transaction,
+# so readers are not blocked by a writer, keeps 64 MiB of pages cached and 256 MiB
+# memory mapped per connection and waits for locks instead of failing at once.
+SQLITE_PROFILES = {
+    "default": {},
+    "tuned": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "cache_size": -65536,
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY",
+    },
+} # type: Dict[str, Dict[str, Any]]
+
+
+class PoolMetrics(object):
+    """Counters of the connection pool events of one engine."""
+
+    def __init__(self) -> None:
+        """Constructor."""
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def _count(self, name: str) -> None:
+        """Increment one counter."""
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def listen(self, engine: Engine) -> None:
+        """Count the pool events of the engine."""
+        event.listen(engine, "connect", lambda *args: self._count("connects"))
+        event.listen(engine, "checkout", lambda *args: self._count("checkouts"))
+        event.listen(engine, "checkin", lambda *args: self._count("checkins"))
+        event.listen(engine, "invalidate", lambda *args: self._count("invalidations"))
+
+    @property
+    def checked_out(self) -> int:
+        """Number of connections currently held by sessions."""
+        return self.checkouts - self.checkins
+
+
+def set_pragmas(engine: Engine, pragmas: Dict[str, Any]) -> None:
+    """Set SQLite pragmas on every connection the engine opens, in the order given."""
+    def connect(dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute("PRAGMA %s = %s" % (name, value))
+        cursor.close()
+
+    event.listen(engine, "connect", connect)
+
+
+def _configure(engine: Engine, backend: str, sqlite_profile: str, journal_mode: Optional[str],
+               synchronous: Optional[str]) -> None:
+    """Add the pool metrics and SQLite pragmas to a new engine."""
+    engine.pool_metrics = PoolMetrics()
+    engine.pool_metrics.listen(engine)
+    if sqlite_profile not in SQLITE_PROFILES:
+        raise ValueError("Unknown SQLite profile %s" % sqlite_profile)
+    # journal_mode and synchronous override the ones of the profile
+    pragmas = dict(SQLITE_PROFILES[sqlite_profile])
+    if journal_mode is not None:
+        if journal_mode.upper() not in JOURNAL_MODES:
+            raise ValueError("Unknown journal mode %s" % journal_mode)
+        pragmas["journal_mode"] = journal_mode.upper()
+    if synchronous is not None:
+        if synchronous.upper() not in SYNCHRONOUS:
+            raise ValueError("Unknown synchronous level %s" % synchronous)
+        pragmas["synchronous"] = synchronous.upper()
+    if pragmas and backend == "sqlite":
+        set_pragmas(engine, pragmas)
+
+
+def create_db_engine(db_url: str, pool_size: int = 5, max_overflow: int = 10, pool_recycle: int = 3600,
+                     sqlite_profile: str = "default",
+                     journal_mode: Optional[str] = None, synchronous: Optional[str] = None,
+                     statement_cache_size: Optional[int] = None, **kwargs: Any) -> Engine:
+    """Create an engine whose pool holds at most pool_size + max_overflow connections.
+
+    Connections older than pool_recycle seconds are replaced on checkout. SQLite uses a
+    pool without size limits, so pool_size and max_overflow only apply to other databases.
+    The storage layout of the triples is the one of the database, see hydrus.data.store.
+
+    sqlite_profile selects the pragmas of SQLITE_PROFILES set on every SQLite connection,
+    journal_mode (one of JOURNAL_MODES) and synchronous (one of SYNCHRONOUS) override
+    those of the profile; None keeps them. The pragmas are ignored for other databases.
+    statement_cache_size is the number of compiled statements the engine keeps.
+    """
+    backend = make_url(db_url).get_backend_name()
+    if backend != "sqlite":
+        kwargs.update(pool_size=pool_size, max_overflow=max_overflow, pool_pre_ping=True)
+    if statement_cache_size is not None:
+        kwargs.update(query_cache_size=statement_cache_size)
+    engine = create_engine(db_url, pool_recycle=pool_recycle, **kwargs)
+    _configure(engine, backend, sqlite_profile, journal_mode, synchronous)
+    return engine
+
+
+def async_url(db_url: str) -> str:
+    """Return a database URL with the async driver of its backend, unless it names a driver."""
+    url = make_url(db_url)
+    if "+" in url.drivername:
+        return str(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError("No async driver is known for %s databases" % backend)
+    return str(url.set(drivername=backend + "+" + ASYNC_DRIVERS[backend]))
+
+
+def create_async_db_engine(db_url: str, pool_size: int = 5, max_overflow: int = 10, pool_recycle: int = 3600,
+                           sqlite_profile: str = "default",
+                           journal_mode: Optional[str] = None, synchronous: Optional[str] = None,
+                           statement_cache_size: Optional[int] = None, **kwargs: Any) -> Any:
+    """Create an AsyncEngine like create_db_engine, see async_url for the driver it uses.
+
+    The pool metrics and pragmas are kept on its sync_engine, which is
+    what the sessions of AsyncSession.run_sync are bound to.
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    url = async_url(db_url)
+    backend = make_url(url).get_backend_name()
+    if backend != "sqlite":
+        kwargs.update(pool_size=pool_size, max_overflow=max_overflow, pool_pre_ping=True)
+    if statement_cache_size is not None:
+        kwargs.update(query_cache_size=statement_cache_size)
+    engine = create_async_engine(url, pool_recycle=pool_recycle, **kwargs)
+    _configure(engine.sync_engine, backend, sqlite_profile, journal_mode, synchronous)
+    return engine
+
+
+def pool_status(engine: Engine) -> Dict[str, Any]:
+    """Return the pool counters of an engine made by create_db_engine and the pool's own status."""
+    metrics = engine.pool_metrics
+    return {
+        "pool": engine.pool.status(),
+        "connects": metrics.connects,
+        "checkouts": metrics.checkouts,
+        "checkins": metrics.checkins,
+        "checked_out": metrics.checked_out,
+        "invalidations": metrics.invalidations,
+    }
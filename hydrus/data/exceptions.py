@@ -1,5 +1,5 @@
 """Exceptions for the crud operations."""
-from typing import Dict, Tuple, Union
+from typing import Any, Dict, Tuple, Union
 from falcon import HTTP_400, HTTP_404, HTTPStatus
 
 
@@ -83,6 +83,47 @@ class NotAbstractProperty(Exception):
         return HTTP_400, {"message": "The property %s is not an Abstract property" % self.type_}
 
 
+class InvalidObject(Exception):
+    """Error when an object in a bulk request is malformed."""
+
+    def __init__(self, index: int, reason: str) -> None:
+        """Constructor."""
+        self.index = index
+        self.reason = reason
+
+    def get_HTTP(self) -> Tuple[HTTPStatus, Dict[str, str]]:
+        """Return the HTTP response for the Exception."""
+        return HTTP_400, {"message": "Object %s of the request is invalid: %s" % (str(self.index), self.reason)}
+
+
+class InvalidValue(Exception):
+    """Error when a value does not match the range of its Property."""
+
+    def __init__(self, type_: str, value: Any, datatype: str) -> None:
+        """Constructor."""
+        self.type_ = type_
+        self.value = value
+        self.datatype = datatype
+
+    def get_HTTP(self) -> Tuple[HTTPStatus, Dict[str, str]]:
+        """Return the HTTP response for the Exception."""
+        return HTTP_400, {"message": "The value %s of property %s is not a valid %s" % (
+            str(self.value), self.type_, self.datatype)}
+
+
+class InvalidFilter(Exception):
+    """Error when a filter of a collection request can not be applied."""
+
+    def __init__(self, param: str, reason: str) -> None:
+        """Constructor."""
+        self.param = param
+        self.reason = reason
+
+    def get_HTTP(self) -> Tuple[HTTPStatus, Dict[str, str]]:
+        """Return the HTTP response for the Exception."""
+        return HTTP_400, {"message": "The filter %s is invalid: %s" % (self.param, self.reason)}
+
+
 class UserExists(Exception):
     """Error when the User already exitst."""
 
@@ -0,0 +1,131 @@
+"""Export of the stored objects as NDJSON, JSON-LD or N-Triples."""
+
+import json
+from sqlalchemy import select
+from hydrus.data.datatypes import XSD
+from hydrus.data.db_models import Instance
+from hydrus.data.crud import _closure, _hydrate
+from hydrus.data.schema import Schema, get_schema
+from hydrus.data.store import get_store
+from sqlalchemy.orm.scoping import scoped_session
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+FORMATS = ("ndjson", "jsonld", "ntriples")
+
+RDF_TYPE = "<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>"
+
+# Literals of typed properties are written with these datatypes, dates stay plain
+LITERAL_TYPES = {"integer": XSD + "integer", "float": XSD + "double", "boolean": XSD + "boolean"}
+
+
+def _root_batches(session: scoped_session, class_id: Optional[int],
+                  batch_size: int) -> Iterator[List[Tuple[int, int]]]:
+    """Yield the ID and class of every Instance not nested in another one, batch_size at a time.
+
+    The instances are read through a server-side cursor in ID order.
+    """
+    graphiii = get_store(session).edges("graphiii")
+    query = session.query(Instance.id, Instance.type_).filter(~Instance.id.in_(select([graphiii.c.object_])))
+    if class_id is not None:
+        query = query.filter(Instance.type_ == class_id)
+    batch = list() # type: List[Tuple[int, int]]
+    for row in query.order_by(Instance.id).yield_per(batch_size):
+        batch.append((row.id, row.type_))
+        if len(batch) == batch_size:
+            yield batch
+            batch = list()
+    if batch:
+        yield batch
+
+
+def export_objects(api_name: str, session: scoped_session, type_: Optional[str] = None,
+                   batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+    """Yield every stored object, or every object of class type_, with its nested objects.
+
+    Objects nested in another object are only exported inside it. Memory use depends
+    on batch_size, not on the number of objects.
+    """
+    schema = get_schema(session)
+    class_id = None if type_ is None else schema.class_id(type_)
+    for batch in _root_batches(session, class_id, batch_size):
+        objects = _hydrate(Instance.id.in_([id_ for id_, _ in batch]), session)
+        for id_, instance_class in batch:
+            object_ = {"@id": "/" + api_name + "/" + schema.class_names[instance_class] + "Collection/" + str(id_)}
+            object_.update(objects[id_])
+            yield object_
+
+
+def _literal(value: Any, datatype: Optional[str] = None) -> str:
+    """Encode a terminal value as an N-Triples literal, typed if a datatype is given."""
+    value = "" if value is None else str(value)
+    for char, escape in [("\\", "\\\\"), ('"', '\\"'), ("\n", "\\n"), ("\r", "\\r")]:
+        value = value.replace(char, escape)
+    if datatype in LITERAL_TYPES:
+        return '"%s"^^<%s>' % (value, LITERAL_TYPES[datatype])
+    return '"' + value + '"'
+
+
+def _ntriples(ids: List[int], session: scoped_session, schema: Schema, address: str) -> List[str]:
+    """Return the N-Triples of the given instances and of all instances nested under them."""
+    vocab = "<" + address + "/vocab#%s>"
+    closure_ids = _closure(Instance.id.in_(ids), session)
+    store = get_store(session)
+    graphiac = store.edges("graphiac")
+    graphiii = store.edges("graphiii")
+    terminals = store.terminals()
+
+    iris = dict() # type: Dict[int, str]
+    lines = list() # type: List[str]
+    for id_, class_id in session.query(Instance.id, Instance.type_).filter(
+            Instance.id.in_(closure_ids)).order_by(Instance.id):
+        iris[id_] = "<%s/%sCollection/%s>" % (address, schema.class_names[class_id], id_)
+        lines.append("%s %s %s ." % (iris[id_], RDF_TYPE, vocab % schema.class_names[class_id]))
+
+    for subject, predicate, class_id in session.query(graphiac.c.subject, graphiac.c.predicate,
+                                                      graphiac.c.object_).filter(graphiac.c.subject.in_(closure_ids)):
+        lines.append("%s %s %s ." % (iris[subject], vocab % schema.property_names[predicate],
+                                     vocab % schema.class_names[class_id]))
+    for subject, predicate, object_id in session.query(graphiii.c.subject, graphiii.c.predicate,
+                                                       graphiii.c.object_).filter(graphiii.c.subject.in_(closure_ids)):
+        lines.append("%s %s %s ." % (iris[subject], vocab % schema.property_names[predicate], iris[object_id]))
+    for subject, predicate, value, number in session.query(
+            terminals.c.subject, terminals.c.predicate, terminals.c.value,
+            terminals.c.number).filter(terminals.c.subject.in_(closure_ids)):
+        # Values stored before their property had a range are not typed
+        datatype = schema.datatypes[predicate] if number is not None else None
+        lines.append("%s %s %s ." % (iris[subject], vocab % schema.property_names[predicate],
+                                     _literal(value, datatype)))
+    return lines
+
+
+def export(api_name: str, session: scoped_session, format_: str = "ndjson", type_: Optional[str] = None,
+           hydrus_server_url: str = "http://localhost/", batch_size: int = 500) -> Iterator[str]:
+    """Export the stored objects as chunks of text in one of FORMATS.
+
+    ndjson writes one object per line, jsonld one document with an @graph of all objects
+    and ntriples the triples of every instance, with IRIs under hydrus_server_url.
+    """
+    if format_ not in FORMATS:
+        raise ValueError("Unknown export format %s" % format_)
+    address = hydrus_server_url + api_name
+
+    if format_ == "ntriples":
+        schema = get_schema(session)
+        class_id = None if type_ is None else schema.class_id(type_)
+        for batch in _root_batches(session, class_id, batch_size):
+            yield "".join(line + "\n" for line in _ntriples([id_ for id_, _ in batch], session, schema, address))
+        return
+
+    objects = export_objects(api_name, session, type_, batch_size)
+    if format_ == "ndjson":
+        for object_ in objects:
+            yield json.dumps(object_) + "\n"
+        return
+
+    context = {"@base": hydrus_server_url, "@vocab": address + "/vocab#"}
+    yield '{"@context": %s, "@graph": [' % json.dumps(context)
+    separator = "\n"
+    for object_ in objects:
+        yield separator + json.dumps(object_)
+        separator = ",\n"
+    yield "\n]}\n"
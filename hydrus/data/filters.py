@@ -0,0 +1,162 @@
+"""Filters on the property values of collection members, compiled to SQL criteria.
+
+A query parameter of a collection request is a filter name[operator]=value when it
+has an operator or name is a property, other parameters are ignored:
+
+- name=value keeps the members whose name is value, name=a&name=b those whose name is
+  one of the values, like name[in]=a,b
+- name[prefix]=text keeps the members whose name starts with text
+- name[gt|gte|lt|lte]=value compares the values of a property with a typed range (see
+  hydrus.data.datatypes) to a number
+
+name may be a path a.b, matching the values of b on the objects nested under a.
+"""
+
+import operator
+import re
+from urllib.parse import quote
+from sqlalchemy import and_, select
+from sqlalchemy.orm.scoping import scoped_session
+from hydrus.data.datatypes import to_number
+from hydrus.data.db_models import Instance
+from hydrus.data.exceptions import InvalidFilter, PropertyNotFound
+from hydrus.data.schema import Schema, get_schema
+from hydrus.data.store import get_store
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# Query parameters of collection requests that are not filters
+PARAMETERS = ("after", "before", "expand", "pageSize", "stream")
+
+RANGE_OPERATORS = {"gt": operator.gt, "gte": operator.ge, "lt": operator.lt, "lte": operator.le}
+OPERATORS = ("in", "prefix") + tuple(sorted(RANGE_OPERATORS))
+
+_FILTER = re.compile(r"^(\w+(?:\.\w+)*)(?:\[(\w+)\])?$")
+
+
+def _is_filter(param: str, schema: Schema) -> bool:
+    """Return whether a query parameter is a filter, see filter_params."""
+    match = _FILTER.match(param)
+    if param in PARAMETERS or match is None:
+        return False
+    return match.group(2) is not None or match.group(1).split(".")[0] in schema.properties
+
+
+def filter_params(params: Dict[str, Any], schema: Schema) -> Dict[str, Any]:
+    """Return the query parameters of a request that are filters.
+
+    Parameters that are not written name[operator] and whose name does not start with a
+    property, like cache busters or tracking parameters, are ignored.
+    """
+    return dict((name, value) for name, value in params.items() if _is_filter(name, schema))
+
+
+def _number(param: str, value: Any, datatype_: str) -> float:
+    """Return the number a filter value is compared with."""
+    try:
+        return to_number(value, datatype_)
+    except ValueError:
+        raise InvalidFilter(param, "%s is not a valid %s" % (value, datatype_))
+
+
+def _condition(param: str, operator_name: Optional[str], value: Any,
+               datatype_: Optional[str]) -> Callable[[Any, Any], Any]:
+    """Return the condition on the value and number columns of a literal for one filter.
+
+    Values of typed properties are compared by their number, others by their text.
+    """
+    values = value if isinstance(value, list) else [value]
+    if operator_name == "in":
+        values = [item for listed in values for item in listed.split(",")]
+    elif operator_name is None and len(values) > 1:
+        # name=a&name=b
+        operator_name = "in"
+    elif len(values) > 1:
+        raise InvalidFilter(param, "it is given more than once")
+    if operator_name is not None and operator_name not in OPERATORS:
+        raise InvalidFilter(param, "the operator must be one of %s" % ", ".join(OPERATORS))
+
+    if operator_name == "prefix":
+        prefix = values[0]
+        if not prefix:
+            raise InvalidFilter(param, "the prefix is empty")
+        # The range lets the database use an index, startswith keeps the match exact
+        end = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return lambda value, number: and_(value >= prefix, value < end, value.startswith(prefix, autoescape=True))
+
+    if datatype_ is None:
+        if operator_name in RANGE_OPERATORS:
+            raise InvalidFilter(param, "the property has no numeric or date range")
+        if operator_name == "in":
+            return lambda value, number: value.in_(values)
+        return lambda value, number: value == values[0]
+
+    numbers = [_number(param, item, datatype_) for item in values]
+    if operator_name in RANGE_OPERATORS:
+        compare = RANGE_OPERATORS[operator_name]
+        return lambda value, number: compare(number, numbers[0])
+    if operator_name == "in":
+        return lambda value, number: number.in_(numbers)
+    return lambda value, number: number == numbers[0]
+
+
+def compile_filters(filters: Dict[str, Any], session: scoped_session) -> List[Any]:
+    """Return one criterion on Instance.id per filter, members must match all of them.
+
+    Every criterion is an IN subquery on the literals of one property, nested in one IN
+    subquery on graphiii per step of a path, so the database does all the filtering.
+    Raises InvalidFilter.
+    """
+    schema = get_schema(session)
+    store = get_store(session)
+    graphiii = store.edges("graphiii")
+    criteria = list() # type: List[Any]
+    for param in sorted(filters):
+        match = _FILTER.match(param)
+        if match is None:
+            raise InvalidFilter(param, "filters are written property[operator]=value")
+        path, operator_name = match.group(1).split("."), match.group(2)
+        try:
+            property_ids = [schema.property_(name)[0] for name in path]
+        except PropertyNotFound as e:
+            raise InvalidFilter(param, "%s is not a property" % e.type_)
+
+        condition = _condition(param, operator_name, filters[param], schema.datatypes[property_ids[-1]])
+        subjects = store.literal_subjects(property_ids[-1], condition)
+        for property_id in reversed(property_ids[:-1]):
+            subjects = select([graphiii.c.subject]).where(and_(
+                graphiii.c.predicate == property_id, graphiii.c.object_.in_(subjects)))
+        criteria.append(Instance.id.in_(subjects))
+    return criteria
+
+
+def search_template(collection_id: str, properties: Sequence[Tuple[str, str]], schema: Schema) -> Dict[str, Any]:
+    """Return the Hydra IriTemplate of the filters of a collection.
+
+    properties are the title and IRI of every supported property of the class of the
+    collection. Range operators are only advertised for properties with a typed range.
+    Properties whose values are nested objects, with the IRI vocab:<class>, match no
+    filter and paths into nested objects are not advertised.
+    """
+    mapping = list() # type: List[Dict[str, Any]]
+    for title, iri in properties:
+        if title not in schema.properties or not re.match(r"^\w+$", title):
+            continue
+        if iri.startswith("vocab:") and iri[len("vocab:"):] in schema.class_ids:
+            continue
+        operator_names = ["in", "prefix"]
+        if schema.datatypes[schema.properties[title][0]] is not None:
+            operator_names += sorted(RANGE_OPERATORS)
+        for variable in [title] + ["%s[%s]" % (title, name) for name in operator_names]:
+            mapping.append({
+                "@type": "IriTemplateMapping",
+                # Brackets are not allowed in template variables
+                "variable": quote(variable),
+                "property": iri,
+                "required": False,
+            })
+    return {
+        "@type": "IriTemplate",
+        "template": collection_id.rstrip("/") + "{?" + ",".join(item["variable"] for item in mapping) + "}",
+        "variableRepresentation": "BasicRepresentation",
+        "mapping": mapping,
+    }
@@ -1,6 +1,7 @@
 """Definition of all Classes in the SubSystem and Spacecraft vocabulary."""
 
 import hydrus.data.db_models as models
+from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from hydrus.metadata.subsystem.spacecraft_vocab_jsonld import spacecraft_data
 from hydrus.metadata.subsystem.subsystem_vocab_jsonld import subsystem_data
@@ -52,7 +53,7 @@ server_labels = ['drone', 'message', 'logs', 'status', 'datastream']
 server_classes = gen_classes(server_labels)
 
 if __name__ == "__main__":
-    Session = sessionmaker(bind=models.engine)
+    Session = sessionmaker(bind=create_engine('sqlite:///database.db'))
     session = Session()
 
     # session.add_all(subsystem_classes)
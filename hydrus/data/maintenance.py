@@ -0,0 +1,183 @@
+"""Maintenance of existing databases."""
+
+from sqlalchemy import and_, inspect, literal, select, func, text, true
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm.scoping import scoped_session
+from hydrus.data.db_models import Base, BaseProperty, Graph, Terminal, Triple
+from hydrus.data.store import KINDS, STORES, JoinedStore, advance_sequence, get_store, record_layout, set_layout
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# Columns added to existing tables since the first release, in the order they were added
+ADDED_COLUMNS = [
+    # Literal values of inline terminals
+    (JoinedStore.models["graphiit"].__table__, "value"),
+    (Triple.__table__, "value"),
+    # Typed literal values
+    (BaseProperty.__table__, "range_"),
+    (Terminal.__table__, "number"),
+    (JoinedStore.models["graphiit"].__table__, "number"),
+    (Triple.__table__, "number"),
+]
+
+
+def create_tables(engine: Engine) -> None:
+    """Create the missing tables and add the columns introduced after a database was created.
+
+    The indexes on an added column are created with it.
+    """
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        for table, name in ADDED_COLUMNS:
+            if name in [column["name"] for column in inspector.get_columns(table.name)]:
+                continue
+            column = table.c[name]
+            connection.execute(text("ALTER TABLE %s ADD COLUMN %s %s" % (
+                table.name, name, column.type.compile(dialect=engine.dialect))))
+            for index in table.indexes:
+                if column in index.columns.values():
+                    index.create(bind=connection)
+
+
+def migrate(session: scoped_session, layout: str) -> int:
+    """Move every Instance triple to the given storage layout, return how many were moved.
+
+    The triples are copied with one INSERT ... SELECT per table and the old rows deleted
+    in the same transaction, which records the new layout; the engine of the session
+    uses it afterwards.
+    """
+    if layout not in STORES:
+        raise ValueError("Unknown storage layout %s" % layout)
+    store = get_store(session)
+    if store.layout == layout:
+        record_layout(session, layout, store.inline_terminals)
+        session.commit()
+        return 0
+
+    triples = Triple.__table__
+    moved = 0
+
+    def columns(kind: str) -> List[str]:
+        """Return the columns copied for the triples of a kind, besides the ID."""
+        if kind == "graphiit" and store.inline_terminals:
+            return ["subject", "predicate", "object_", "value", "number"]
+        return ["subject", "predicate", "object_"]
+
+    if layout == "triples":
+        for kind in KINDS:
+            table = JoinedStore.models[kind].__table__
+            moved += session.execute(triples.insert().from_select(
+                ["kind"] + columns(kind),
+                select([literal(kind)] + [table.c[name] for name in columns(kind)]).order_by(
+                    table.c.id))).rowcount
+            session.execute(table.delete())
+        session.execute(Graph.__table__.delete().where(Graph.type.in_(KINDS)))
+    else:
+        # graph IDs continue after the class triples of graphcac
+        offset = session.query(func.max(Graph.id)).scalar() or 0
+        session.execute(Graph.__table__.insert().from_select(
+            ["id", "type"], select([triples.c.id + offset, triples.c.kind])))
+        for kind in KINDS:
+            table = JoinedStore.models[kind].__table__
+            session.execute(table.insert().from_select(
+                ["id"] + columns(kind),
+                select([triples.c.id + offset] + [triples.c[name] for name in columns(kind)]).where(
+                    triples.c.kind == kind)))
+        advance_sequence(session, "graph")
+        moved = session.execute(triples.delete()).rowcount
+    record_layout(session, layout, store.inline_terminals)
+    session.commit()
+    set_layout(session.get_bind().engine, layout, store.inline_terminals)
+    return moved
+
+
+def _graphiit(layout: str) -> Tuple[Any, Any]:
+    """Return the table holding the graphiit triples of a layout and the criterion selecting them."""
+    if layout == "triples":
+        return Triple.__table__, Triple.__table__.c.kind == "graphiit"
+    return JoinedStore.models["graphiit"].__table__, true()
+
+
+def move_terminals(session: scoped_session, inline: bool) -> int:
+    """Move the literal values between the terminals table and the graphiit triples.
+
+    Return how many values were moved; like migrate, everything happens in one
+    transaction and the engine of the session uses the new mode afterwards. Databases
+    created before inline terminals existed need create_tables first.
+    """
+    store = get_store(session)
+    if store.inline_terminals == inline:
+        record_layout(session, store.layout, inline)
+        session.commit()
+        return 0
+    table, criterion = _graphiit(store.layout)
+    terminals = Terminal.__table__
+
+    if inline:
+        value = select([terminals.c.value]).where(terminals.c.id == table.c.object_).scalar_subquery()
+        number = select([terminals.c.number]).where(terminals.c.id == table.c.object_).scalar_subquery()
+        moved = session.execute(table.update().where(and_(criterion, table.c.object_.isnot(None))).values(
+            value=value, number=number, object_=None)).rowcount
+        session.execute(terminals.delete().where(~terminals.c.id.in_(
+            select([table.c.object_]).where(and_(criterion, table.c.object_.isnot(None))))))
+    else:
+        # Every value gets a new terminal, numbered after the existing ones
+        offset = session.query(func.max(Terminal.id)).scalar() or 0
+        session.execute(terminals.insert().from_select(["id", "value", "number"], select(
+            [table.c.id + offset, table.c.value, table.c.number]).where(and_(criterion, table.c.object_.is_(None)))))
+        moved = session.execute(table.update().where(and_(criterion, table.c.object_.is_(None))).values(
+            object_=table.c.id + offset, value=None, number=None)).rowcount
+        advance_sequence(session, "terminals")
+    record_layout(session, store.layout, inline)
+    session.commit()
+    set_layout(session.get_bind().engine, store.layout, inline)
+    return moved
+
+
+def _sizes(session: scoped_session) -> Dict[str, Optional[int]]:
+    """Return the bytes used by every table and index, when the database can tell."""
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        rows = session.execute(text("SELECT relname, pg_relation_size(oid) FROM pg_class "
+                                    "WHERE relkind IN ('r', 'i') AND relnamespace = 'public'::regnamespace"))
+        return dict((name, size) for name, size in rows)
+    if dialect == "sqlite":
+        try:
+            # Only available if SQLite was compiled with the dbstat virtual table
+            rows = session.execute(text("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name"))
+            return dict((name, size) for name, size in rows)
+        except DBAPIError:
+            session.rollback()
+    return dict()
+
+
+def optimize(session: scoped_session) -> Dict[str, Any]:
+    """Create the indexes declared in db_models that are missing and refresh the planner statistics.
+
+    Returns the names of the created indexes and the rows and size of every table and
+    index; sizes are None if the database does not report them.
+    """
+    connection = session.connection()
+    inspector = inspect(connection)
+    created = list() # type: List[str]
+    for table in Base.metadata.sorted_tables:
+        existing = set(index["name"] for index in inspector.get_indexes(table.name))
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing:
+                index.create(bind=connection)
+                created.append(index.name)
+    session.execute(text("ANALYZE"))
+    session.commit()
+
+    sizes = _sizes(session)
+    tables = list() # type: List[Dict[str, Any]]
+    for table in Base.metadata.sorted_tables:
+        tables.append({
+            "name": table.name,
+            "rows": session.query(func.count()).select_from(table).scalar(),
+            "bytes": sizes.get(table.name),
+            "indexes": dict((index.name, sizes.get(index.name)) for index in table.indexes),
+        })
+    return {"created": created, "tables": tables}
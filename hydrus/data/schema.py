@@ -0,0 +1,108 @@
+"""Process wide cache of the classes and properties stored in the database."""
+
+import threading
+from weakref import WeakKeyDictionary
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.scoping import scoped_session
+from hydrus.data.datatypes import datatype
+from hydrus.data.db_models import RDFClass, BaseProperty
+from hydrus.data.exceptions import ClassNotFound, PropertyNotFound
+from typing import Any, Dict, Optional, Tuple
+
+
+class Schema(object):
+    """Name <-> ID maps of the RDFClasses and Properties of one database.
+
+    The classes and properties are fixed once doc_parse has inserted them, only the type_
+    of a property changes when crud.insert first uses it; every change goes through
+    invalidate_schema or invalidate_schema_on_end so a Schema is never updated in place.
+    """
+
+    def __init__(self, session: scoped_session) -> None:
+        """Load the classes and properties with one query each."""
+        self.class_ids = dict() # type: Dict[str, int]
+        self.class_names = dict() # type: Dict[int, str]
+        for id_, name in session.query(RDFClass.id, RDFClass.name):
+            self.class_ids[name] = id_
+            self.class_names[id_] = name
+
+        self.properties = dict() # type: Dict[str, Tuple[int, str]]
+        self.property_names = dict() # type: Dict[int, str]
+        # integer, float, boolean or dateTime for properties with a typed range
+        self.datatypes = dict() # type: Dict[int, Optional[str]]
+        for id_, name, type_, range_ in session.query(BaseProperty.id, BaseProperty.name, BaseProperty.type_,
+                                                      BaseProperty.range_):
+            self.properties[name] = (id_, type_)
+            self.property_names[id_] = name
+            self.datatypes[id_] = datatype(range_)
+
+    def class_id(self, name: str) -> int:
+        """Return the ID of the RDFClass with the given name."""
+        try:
+            return self.class_ids[name]
+        except KeyError:
+            raise ClassNotFound(type_=name)
+
+    def property_(self, name: str) -> Tuple[int, str]:
+        """Return the ID and type_ of the Property with the given name."""
+        try:
+            return self.properties[name]
+        except KeyError:
+            raise PropertyNotFound(type_=name)
+
+
+_schemas = WeakKeyDictionary() # type: WeakKeyDictionary
+_lock = threading.Lock()
+# Bumped by every invalidation, a Schema loaded across an invalidation is not cached
+_generation = 0
+# Key of the session info holding the engines to invalidate when the transaction ends
+_PENDING = "hydrus_invalidate_schema"
+
+
+def _engine(session: scoped_session) -> Any:
+    """Return the Engine the session is bound to."""
+    return session.get_bind().engine
+
+
+def get_schema(session: scoped_session) -> Schema:
+    """Return the cached Schema of the database of the session, loading it on first use."""
+    engine = _engine(session)
+    schema = _schemas.get(engine)
+    if schema is None:
+        generation = _generation
+        schema = Schema(session)
+        with _lock:
+            if generation == _generation:
+                _schemas[engine] = schema
+    return schema
+
+
+def _invalidate(engine: Any) -> None:
+    """Drop the cached Schema of an engine."""
+    global _generation
+    with _lock:
+        _generation += 1
+        _schemas.pop(engine, None)
+
+
+def invalidate_schema(session: scoped_session) -> None:
+    """Drop the cached Schema of the database of the session, it is reloaded on next use."""
+    _invalidate(_engine(session))
+
+
+def invalidate_schema_on_end(session: scoped_session) -> None:
+    """Drop the cached Schema of the database of the session once its transaction ends.
+
+    For changes made inside a transaction: dropping it before the commit would let the
+    next get_schema cache the uncommitted rows, and a rollback must drop it as well.
+    """
+    session.info.setdefault(_PENDING, set()).add(_engine(session))
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _invalidate_pending(session: Session, transaction: Any) -> None:
+    """Invalidate the Schemas changed in a transaction, after its commit or rollback."""
+    if transaction.parent is None:
+        for engine in session.info.pop(_PENDING, ()):
+            _invalidate(engine)
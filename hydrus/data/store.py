@@ -0,0 +1,320 @@
+"""Storage layouts of the Instance triples.
+
+The joined layout stores a triple as a row in graph and a row in graphiac, graphiii or
+graphiit, as mapped by db_models.Graph. The triples layout stores it as one row of the
+triples table. With either layout the literal values of graphiit triples are kept in
+the terminals table, or inline in the value and number columns of the triple row. crud, bulk and
+export only use the store from get_store, so they work with every combination.
+
+The layout and where the literal values are kept are recorded in the settings table of
+the database by configure_layout and hydrus.data.maintenance, so they are never guessed
+differently from the data.
+"""
+
+import threading
+from weakref import WeakKeyDictionary
+from sqlalchemy import and_, exists, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm.scoping import scoped_session
+from hydrus.data.db_models import Graph, GraphIAC, GraphIII, GraphIIT, Setting, Terminal, Triple
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Instance >> AbstractProperty >> Class, Instance >> InstanceProperty >> Instance and
+# Instance >> InstanceProperty >> Terminal
+KINDS = ("graphiac", "graphiii", "graphiit")
+
+
+def advance_sequence(session: scoped_session, table: str) -> None:
+    """Move the PostgreSQL ID sequence of a table past rows inserted with explicit IDs."""
+    if session.get_bind().dialect.name == "postgresql":
+        session.execute(text("SELECT setval(pg_get_serial_sequence(:table, 'id'), "
+                             "(SELECT MAX(id) FROM %s))" % table), {"table": table})
+
+
+def reserve_ids(session: scoped_session, table: str, count: int) -> List[int]:
+    """Return count new IDs for rows of a table, no other transaction is given the same ones.
+
+    PostgreSQL takes them from the ID sequence of the table. SQLite has no sequences, the
+    IDs follow the maximum ID once the transaction holds the write lock: BEGIN IMMEDIATE
+    takes it unless the transaction already wrote, so concurrent writers wait for it to end.
+    """
+    if count == 0:
+        return list()
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        return [row[0] for row in session.execute(text(
+            "SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :count)"),
+            {"table": table, "count": count})]
+    if dialect == "sqlite" and not getattr(session.connection().connection.dbapi_connection, "in_transaction", True):
+        session.execute(text("BEGIN IMMEDIATE"))
+    start = (session.execute(text("SELECT MAX(id) FROM %s" % table)).scalar() or 0) + 1
+    return list(range(start, start + count))
+
+
+class _Store(object):
+    """Handling of the literal values, shared by both layouts."""
+
+    layout = None # type: str
+
+    def __init__(self, inline_terminals: bool = False) -> None:
+        """Constructor."""
+        self.inline_terminals = inline_terminals
+
+    def terminals(self) -> Any:
+        """Return a selectable with the subject, predicate, terminal, value and number of every graphiit triple.
+
+        terminal is NULL when the Terminal a triple points to is missing.
+        """
+        graphiit = self.edges("graphiit")
+        if self.inline_terminals:
+            return select([graphiit.c.subject, graphiit.c.predicate, graphiit.c.subject.label("terminal"),
+                           graphiit.c.value, graphiit.c.number]).alias("terminal_values")
+        return select([graphiit.c.subject, graphiit.c.predicate, Terminal.id.label("terminal"),
+                       Terminal.value, Terminal.number]).select_from(graphiit.outerjoin(
+                           Terminal.__table__, Terminal.id == graphiit.c.object_)).alias("terminal_values")
+
+    def literal_subjects(self, predicate: int, condition: Callable[[Any, Any], Any]) -> Any:
+        """Select the subjects of the graphiit triples of a predicate whose literal matches a condition.
+
+        condition is called with the value and number columns of the table holding the
+        literals and returns a criterion; unlike terminals the select is an inner join, so
+        the planner can start from the indexes of those columns.
+        """
+        graphiit = self.edges("graphiit")
+        if self.inline_terminals:
+            return select([graphiit.c.subject]).where(and_(
+                graphiit.c.predicate == predicate, condition(graphiit.c.value, graphiit.c.number)))
+        return select([graphiit.c.subject]).select_from(graphiit.join(
+            Terminal.__table__, Terminal.id == graphiit.c.object_)).where(and_(
+                graphiit.c.predicate == predicate, condition(Terminal.value, Terminal.number)))
+
+    def add_terminal(self, session: scoped_session, subject: int, predicate: int, value: Any,
+                     number: Optional[float] = None) -> None:
+        """Add a graphiit triple with a literal value, and its number if typed, to the session."""
+        if self.inline_terminals:
+            self.add(session, "graphiit", subject, predicate, None, value=value, number=number)
+        else:
+            terminal = Terminal(value=value, number=number)
+            session.add(terminal)
+            session.flush()     # Assigns ID without committing
+            self.add(session, "graphiit", subject, predicate, terminal.id)
+
+    def _triple_rows(self, session: scoped_session, rows: Dict[str, List[Dict[str, Any]]]) -> Dict[str, List]:
+        """Replace the values of graphiit rows by the IDs of new terminals, unless they are inline."""
+        if self.inline_terminals:
+            return dict(rows, graphiit=[dict(row, object_=None) for row in rows.get("graphiit", [])])
+        ids = reserve_ids(session, "terminals", len(rows.get("graphiit", [])))
+        terminal_rows = list() # type: List[Dict[str, Any]]
+        graphiit_rows = list() # type: List[Dict[str, Any]]
+        for id_, row in zip(ids, rows.get("graphiit", [])):
+            terminal_rows.append({"id": id_, "value": row["value"], "number": row["number"], "unit": None})
+            graphiit_rows.append({"subject": row["subject"], "predicate": row["predicate"], "object_": id_})
+        if terminal_rows:
+            session.execute(Terminal.__table__.insert(), terminal_rows)
+        return dict(rows, graphiit=graphiit_rows)
+
+    def delete(self, session: scoped_session, kind: str, subjects: Any, predicate: Optional[int] = None) -> None:
+        """Delete the triples of a kind whose subject is in subjects, a list or a select of IDs.
+
+        With a predicate only the triples of that property are deleted.
+        """
+        terminal_ids = list() # type: List[int]
+        if kind == "graphiit" and not self.inline_terminals:
+            graphiit = self.edges("graphiit")
+            terminal_ids = [row.object_ for row in session.execute(
+                select([graphiit.c.object_]).where(self._triples(graphiit, subjects, predicate)))]
+        self._delete(session, kind, subjects, predicate)
+        if terminal_ids:
+            session.execute(Terminal.__table__.delete().where(Terminal.id.in_(terminal_ids)))
+
+    @staticmethod
+    def _triples(edges: Any, subjects: Any, predicate: Optional[int]) -> Any:
+        """Return the criterion selecting the triples of some subjects, and of one predicate if given."""
+        if predicate is None:
+            return edges.c.subject.in_(subjects)
+        return and_(edges.c.subject.in_(subjects), edges.c.predicate == predicate)
+
+
+class JoinedStore(_Store):
+    """Triples in graph and one joined table per kind."""
+
+    layout = "joined"
+    models = {"graphiac": GraphIAC, "graphiii": GraphIII, "graphiit": GraphIIT}
+
+    def edges(self, kind: str) -> Any:
+        """Return a selectable with the subject, predicate and object_ of every triple of a kind."""
+        return self.models[kind].__table__
+
+    def add(self, session: scoped_session, kind: str, subject: int, predicate: int, object_: int,
+            **columns: Any) -> None:
+        """Add one triple to the session."""
+        session.add(self.models[kind](subject=subject, predicate=predicate, object_=object_, **columns))
+
+    def insert_many(self, session: scoped_session, rows: Dict[str, List[Dict[str, Any]]]) -> None:
+        """Insert triples of every kind with executemany.
+
+        Rows are subject/predicate/object_ dicts, graphiit rows have a value and a number
+        instead of an object_.
+        """
+        rows = self._triple_rows(session, rows)
+        ids = iter(reserve_ids(session, "graph", sum(len(rows.get(kind, [])) for kind in KINDS)))
+        graph_rows = list() # type: List[Dict[str, Any]]
+        kind_rows = dict() # type: Dict[str, List[Dict[str, Any]]]
+        for kind in KINDS:
+            kind_rows[kind] = list()
+            for row in rows.get(kind, []):
+                id_ = next(ids)
+                graph_rows.append({"id": id_, "type": kind})
+                kind_rows[kind].append(dict(row, id=id_))
+        if graph_rows:
+            session.execute(Graph.__table__.insert(), graph_rows)
+        for kind in KINDS:
+            if kind_rows[kind]:
+                session.execute(self.models[kind].__table__.insert(), kind_rows[kind])
+
+    def _delete(self, session: scoped_session, kind: str, subjects: Any, predicate: Optional[int]) -> None:
+        """Delete the triples of a kind, with their graph rows."""
+        table = self.models[kind].__table__
+        ids = [row.id for row in session.execute(select([table.c.id]).where(
+            self._triples(table, subjects, predicate)))]
+        if ids:
+            session.execute(table.delete().where(table.c.id.in_(ids)))
+            session.execute(Graph.__table__.delete().where(Graph.id.in_(ids)))
+
+
+class TriplesStore(_Store):
+    """Triples in the single triples table."""
+
+    layout = "triples"
+
+    def edges(self, kind: str) -> Any:
+        """Return a selectable with the subject, predicate and object_ of every triple of a kind."""
+        table = Triple.__table__
+        columns = [table.c.subject, table.c.predicate, table.c.object_]
+        if kind == "graphiit" and self.inline_terminals:
+            columns += [table.c.value, table.c.number]
+        return select(columns).where(table.c.kind == kind).alias(kind)
+
+    def add(self, session: scoped_session, kind: str, subject: int, predicate: int, object_: int,
+            **columns: Any) -> None:
+        """Add one triple to the session."""
+        session.add(Triple(kind=kind, subject=subject, predicate=predicate, object_=object_, **columns))
+
+    def insert_many(self, session: scoped_session, rows: Dict[str, List[Dict[str, Any]]]) -> None:
+        """Insert triples of every kind with executemany.
+
+        Rows are subject/predicate/object_ dicts, graphiit rows have a value and a number
+        instead of an object_.
+        """
+        rows = self._triple_rows(session, rows)
+        # Rows of every kind need the same keys for one executemany
+        triple_rows = [dict({"value": None, "number": None}, kind=kind, **row) for kind in KINDS for row in rows.get(kind, [])]
+        if triple_rows:
+            session.execute(Triple.__table__.insert(), triple_rows)
+
+    def _delete(self, session: scoped_session, kind: str, subjects: Any, predicate: Optional[int]) -> None:
+        """Delete the triples of a kind."""
+        table = Triple.__table__
+        session.execute(table.delete().where(and_(table.c.kind == kind, self._triples(table, subjects, predicate))))
+
+
+STORES = {"joined": JoinedStore, "triples": TriplesStore}
+# Values of the terminals setting, for inline_terminals False and True
+TERMINALS = ("table", "inline")
+
+_stores = WeakKeyDictionary() # type: WeakKeyDictionary
+_lock = threading.Lock()
+
+
+def set_layout(engine: Engine, layout: str, inline_terminals: bool = False) -> None:
+    """Select the layout used for the database of an engine and where its literal values are kept."""
+    if layout not in STORES:
+        raise ValueError("Unknown storage layout %s" % layout)
+    with _lock:
+        _stores[engine] = STORES[layout](inline_terminals)
+
+
+def _settings(session: scoped_session) -> Dict[str, str]:
+    """Return the settings recorded in the database, none if it has no settings table."""
+    if not session.get_bind().dialect.has_table(session.connection(), Setting.__tablename__):
+        return dict()
+    return dict(session.query(Setting.name, Setting.value))
+
+
+def _detect(session: scoped_session) -> Tuple[Optional[str], Optional[bool]]:
+    """Return the layout and inline mode the stored triples use, None for what the data does not tell.
+
+    The triples layout is used if the triples table holds any row and the joined layout
+    if graph does; literal values are inline if a graphiit triple has no object_.
+    """
+    layout = None
+    if (session.get_bind().dialect.has_table(session.connection(), Triple.__tablename__) and
+            session.query(exists().where(Triple.id.isnot(None))).scalar()):
+        layout = "triples"
+    elif session.query(exists().where(Graph.type.in_(KINDS))).scalar():
+        layout = "joined"
+    inline_terminals = None
+    if layout is not None:
+        graphiit = STORES[layout]().edges("graphiit")
+        literal = session.query(graphiit.c.object_).filter(graphiit.c.subject.isnot(None)).first()
+        if literal is not None:
+            inline_terminals = literal.object_ is None
+    return layout, inline_terminals
+
+
+def _layout(session: scoped_session) -> Tuple[Optional[str], Optional[bool]]:
+    """Return the layout and inline mode of the database, recorded or detected, None for unknown ones."""
+    settings = _settings(session)
+    layout, inline_terminals = _detect(session)
+    if "layout" in settings:
+        layout = settings["layout"]
+    if "terminals" in settings:
+        inline_terminals = settings["terminals"] == "inline"
+    return layout, inline_terminals
+
+
+def record_layout(session: scoped_session, layout: str, inline_terminals: bool) -> None:
+    """Record the layout and inline mode in the settings of the database, without committing."""
+    session.merge(Setting(name="layout", value=layout))
+    session.merge(Setting(name="terminals", value=TERMINALS[inline_terminals]))
+
+
+def configure_layout(session: scoped_session, layout: Optional[str] = None,
+                     inline_terminals: Optional[bool] = None) -> Any:
+    """Check the layout and inline mode of the database, record them and return its store.
+
+    A database without any triple gets the layout and inline mode asked for, by default
+    the joined layout with a terminals table. Raises ValueError if the database already
+    uses others, hydrus.data.maintenance moves it to them.
+    """
+    if layout is not None and layout not in STORES:
+        raise ValueError("Unknown storage layout %s" % layout)
+    current_layout, current_inline = _layout(session)
+    if layout is not None and current_layout not in (None, layout):
+        raise ValueError("The database uses the %s layout, not %s" % (current_layout, layout))
+    if inline_terminals is not None and current_inline not in (None, inline_terminals):
+        raise ValueError("The database keeps its literal values %s, not %s" % (
+            TERMINALS[current_inline], TERMINALS[inline_terminals]))
+    layout = current_layout or layout or "joined"
+    if current_inline is not None:
+        inline_terminals = current_inline
+    record_layout(session, layout, bool(inline_terminals))
+    session.commit()
+    set_layout(session.get_bind().engine, layout, bool(inline_terminals))
+    return get_store(session)
+
+
+def get_store(session: scoped_session) -> Any:
+    """Return the store of the database of the session.
+
+    Unless set_layout was called for its engine, the layout and inline mode recorded in
+    the database are used; without settings they are detected from the stored triples,
+    or are the joined layout with a terminals table.
+    """
+    engine = session.get_bind().engine
+    store = _stores.get(engine)
+    if store is None:
+        layout, inline_terminals = _layout(session)
+        set_layout(engine, layout or "joined", bool(inline_terminals))
+        store = _stores[engine]
+    return store
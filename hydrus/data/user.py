@@ -4,11 +4,74 @@ from sqlalchemy import exists
 from sqlalchemy.orm.exc import NoResultFound
 from hydrus.data.exceptions import UserExists, UserNotFound
 from hydrus.data.db_models import User
-from hashlib import sha224
+from hashlib import sha224, sha256
+from collections import OrderedDict
 import base64
+import threading
+import time
 # import random
 from sqlalchemy.orm.session import Session
 from werkzeug.local import LocalProxy
+from typing import Optional
+
+
+class CredentialCache(object):
+    """Bounded cache of Authorization headers that were verified against the User table.
+
+    Entries are keyed on a digest of the header, expire ttl seconds after verification and
+    the least recently used entry is dropped when maxsize is reached. Only successful
+    verifications are cached, so wrong credentials always reach the database.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0) -> None:
+        """Constructor."""
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict() # type: OrderedDict
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(header: str) -> str:
+        """Return the digest a header is stored under."""
+        return sha256(header.encode('utf-8')).hexdigest()
+
+    def verified(self, header: str) -> bool:
+        """Check if the header was verified less than ttl seconds ago."""
+        key = self._key(header)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            if entry[1] < time.monotonic():
+                del self._entries[key]
+                return False
+            self._entries.move_to_end(key)
+            return True
+
+    def add(self, header: str, id_: str) -> None:
+        """Remember that the header holds valid credentials of the user with the given ID."""
+        with self._lock:
+            self._entries[self._key(header)] = (str(id_), time.monotonic() + self.ttl)
+            self._entries.move_to_end(self._key(header))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, id_: Optional[int] = None) -> None:
+        """Forget the credentials of the user with the given ID, or of every user."""
+        with self._lock:
+            if id_ is None:
+                self._entries.clear()
+            else:
+                for key in [key for key, entry in self._entries.items() if entry[0] == str(id_)]:
+                    del self._entries[key]
+
+
+credential_cache = CredentialCache()
+
+
+def invalidate_credentials(id_: Optional[int] = None) -> None:
+    """Forget cached credentials, must be called whenever a User is changed or removed."""
+    credential_cache.invalidate(id_)
 
 
 def add_user(id_: int, paraphrase: str, session: Session) -> None:
@@ -19,6 +82,7 @@ def add_user(id_: int, paraphrase: str, session: Session) -> None:
         new_user = User(id=id_, paraphrase=sha224(paraphrase.encode('utf-8')).hexdigest())
         session.add(new_user)
         session.commit()
+        invalidate_credentials(id_)
 
 # TODO: Implement handhasking for better security
 # def create_nonce(id_, session):
@@ -57,7 +121,12 @@ def authenticate_user(id_: int, paraphrase: str, session: Session) -> bool:
 
 def check_authorization(request, session: Session) -> bool:
     """Check if the request object has the correct authorization."""
+    if credential_cache.verified(request.auth):
+        return True
     token = request.auth.split()[1]
     token = base64.b64decode(token).decode('utf-8')
     username, password = token.split(':')
-    return authenticate_user(username, password, session)
+    authenticated = authenticate_user(username, password, session)
+    if authenticated:
+        credential_cache.add(request.auth, username)
+    return authenticated
@@ -0,0 +1,68 @@
+"""Dispatch table compiled from the API Documentation."""
+
+from collections import namedtuple
+from types import MappingProxyType
+from hydrus.hydraspec.doc_writer import HydraDoc
+from typing import Any, Dict, Optional
+
+
+# An endpoint listed in the EntryPoint: the methods it supports, whether it is a collection
+# and the title of the class it serves
+Route = namedtuple("Route", ["methods", "collection", "class_"])
+
+# Everything a request handler needs to know about the API Documentation
+DispatchTable = namedtuple("DispatchTable", ["routes", "collections", "singles", "operations", "properties"])
+
+
+def _expects(expects: Optional[str]) -> Optional[str]:
+    """Return the @type expected by an operation."""
+    if expects is None:
+        return None
+    # NOTE: Don't use split, if there are more than one substrings with 'vocab:' not everything will be returned.
+    return expects.replace("vocab:", "")
+
+
+def _iri(prop: Any) -> str:
+    """Return the IRI of a supported property, given as a string or as a property definition."""
+    if isinstance(prop, dict):
+        return prop["@id"]
+    return prop
+
+
+def compile_dispatch(api_doc: HydraDoc) -> DispatchTable:
+    """Compile the API Documentation into read-only lookup tables.
+
+    routes maps EntryPoint endpoints to their Route, collections maps collection names to
+    the title of their class, singles holds the classes that have no collection,
+    operations maps class titles to {method: expected @type} and properties maps class
+    titles to the (title, IRI) of their supported properties.
+    """
+    collections = dict() # type: Dict[str, str]
+    for name in api_doc.collections:
+        collections[name] = api_doc.collections[name]["collection"].class_.title
+
+    routes = dict() # type: Dict[str, Any]
+    for endpoint in api_doc.entrypoint.entrypoint.supportedProperty:
+        methods = frozenset(operation.method for operation in endpoint.supportedOperation)
+        is_collection = endpoint.name in collections
+        class_ = collections[endpoint.name] if is_collection else endpoint.name
+        routes[endpoint.name] = Route(methods, is_collection, class_)
+
+    singles = frozenset(class_ for class_ in api_doc.parsed_classes if class_ + "Collection" not in collections)
+
+    operations = dict() # type: Dict[str, Any]
+    for class_ in api_doc.parsed_classes:
+        class_operations = dict() # type: Dict[str, Optional[str]]
+        for supportedOp in api_doc.parsed_classes[class_]["class"].supportedOperation:
+            # The first operation with a method wins, as it did when the doc was scanned per request
+            if supportedOp.method not in class_operations:
+                class_operations[supportedOp.method] = _expects(supportedOp.expects)
+        operations[class_] = MappingProxyType(class_operations)
+
+    properties = dict() # type: Dict[str, Any]
+    for class_ in api_doc.parsed_classes:
+        properties[class_] = tuple((prop.title, _iri(prop.prop))
+                                   for prop in api_doc.parsed_classes[class_]["class"].supportedProperty)
+
+    return DispatchTable(MappingProxyType(routes), MappingProxyType(collections), singles,
+                         MappingProxyType(operations), MappingProxyType(properties))
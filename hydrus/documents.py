@@ -0,0 +1,52 @@
+"""API Documentation, EntryPoint and contexts rendered once to JSON-LD bytes."""
+
+import json
+from collections import namedtuple
+from hashlib import sha1
+from types import MappingProxyType
+from hydrus.hydraspec.doc_writer import HydraDoc
+from typing import Any, Dict
+
+# Sent with every rendered document, clients revalidate with If-None-Match afterwards
+CACHE_CONTROL = "public, max-age=3600"
+
+# The encoded body of a document and its strong ETag
+Document = namedtuple("Document", ["body", "etag"])
+
+# index is the EntryPoint object, entrypoint its context and contexts maps a class or
+# collection name to its context
+RenderedDocs = namedtuple("RenderedDocs", ["index", "vocab", "entrypoint", "contexts"])
+
+
+def render(object_: Dict[str, Any]) -> Document:
+    """Encode a JSON-LD object and compute its ETag."""
+    body = json.dumps(object_).encode("utf-8")
+    return Document(body, '"' + sha1(body).hexdigest() + '"')
+
+
+def render_docs(api_doc: HydraDoc) -> RenderedDocs:
+    """Render every static document served by the API."""
+    contexts = dict() # type: Dict[str, Document]
+    for name in api_doc.collections:
+        contexts[name] = render({"@context": api_doc.collections[name]["context"].generate()})
+    for name in api_doc.parsed_classes:
+        # Names with Collection in them are only looked up among the collections
+        if "Collection" not in name:
+            contexts[name] = render({"@context": api_doc.parsed_classes[name]["context"].generate()})
+
+    return RenderedDocs(render(api_doc.entrypoint.get()),
+                        render(api_doc.generate()),
+                        render({"@context": api_doc.entrypoint.context.generate()}),
+                        MappingProxyType(contexts))
+
+
+def is_fresh(if_none_match: str, document: Document) -> bool:
+    """Check if an If-None-Match header matches the ETag of a document."""
+    if if_none_match is None:
+        return False
+    for etag in if_none_match.split(","):
+        etag = etag.strip()
+        # If-None-Match uses the weak comparison
+        if etag == "*" or etag.replace("W/", "", 1) == document.etag:
+            return True
+    return False
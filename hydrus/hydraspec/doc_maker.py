@@ -205,7 +205,8 @@ def create_property(supported_prop: Dict[str, Any]) -> HydraClassProp:
     for k, literal in doc_keys.items():
         result[k] = input_key_check(supported_prop, k, "supported_prop", literal)
     # Create the HydraClassProp object
-    prop = HydraClassProp(result["property"], result["title"], required=result["required"], read=result["readonly"], write=result["writeonly"])
+    prop = HydraClassProp(result["property"], result["title"], required=result["required"], read=result["readonly"], write=result["writeonly"],
+                          range_=supported_prop.get("range"))
     return prop
 
 
@@ -134,14 +134,16 @@ class HydraClassProp():
                  write: bool,
                  required: bool,
                  desc: str="",
+                 range_: Optional[str]=None,
                  ) -> None:
-        """Initialize the Hydra_Prop."""
+        """Initialize the Hydra_Prop, range_ is the datatype of its values, like xsd:integer."""
         self.prop = prop
         self.title = title
         self.read = read
         self.write = write
         self.required = required
         self.desc = desc
+        self.range_ = range_
 
     def generate(self) -> Dict[str, Any]:
         """Get the Hydra prop as a python dict."""
@@ -155,6 +157,8 @@ class HydraClassProp():
         }
         if len(self.desc) > 0:
             prop["description"] = self.desc
+        if self.range_ is not None:
+            prop["range"] = self.range_
         return prop
 
 
@@ -490,6 +494,22 @@ class Context():
                 "vocab": address + "/vocab#",
                 "hydra": "http://www.w3.org/ns/hydra/core#",
                 "members": "http://www.w3.org/ns/hydra/core#member",
+                "view": "hydra:view",
+                "PartialCollectionView": "hydra:PartialCollectionView",
+                "first": {"@id": "hydra:first", "@type": "@id"},
+                "last": {"@id": "hydra:last", "@type": "@id"},
+                "next": {"@id": "hydra:next", "@type": "@id"},
+                "previous": {"@id": "hydra:previous", "@type": "@id"},
+                "search": "hydra:search",
+                "IriTemplate": "hydra:IriTemplate",
+                "IriTemplateMapping": "hydra:IriTemplateMapping",
+                "template": "hydra:template",
+                "variableRepresentation": {"@id": "hydra:variableRepresentation", "@type": "@vocab"},
+                "BasicRepresentation": "hydra:BasicRepresentation",
+                "mapping": "hydra:mapping",
+                "variable": "hydra:variable",
+                "property": {"@id": "hydra:property", "@type": "@id"},
+                "required": "hydra:required",
             }
             self.context[collection.name] = "vocab:"+collection.name
             self.context[collection.class_.title] = collection.class_.id_
@@ -0,0 +1,84 @@
+"""Pre-forked server processes sharing one listening socket.
+
+Everything built before prefork is called, like the API Documentation and the app,
+is shared with the workers copy-on-write. Database engines must not hold connections
+when the workers are forked, see Engine.dispose.
+"""
+
+import os
+import signal
+import socket
+import time
+import traceback
+from typing import Callable, Dict
+
+# Workers exiting sooner than this after their start are restarted with a delay
+MIN_UPTIME = 1.0
+
+
+def listen(port: int, host: str = "", backlog: int = 1024) -> socket.socket:
+    """Return a non blocking TCP socket listening on port, to be accepted from by every worker."""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(backlog)
+    listener.setblocking(False)
+    return listener
+
+
+def _spawn(run: Callable[[], None]) -> int:
+    """Fork a worker calling run, return its PID."""
+    pid = os.fork()
+    if pid == 0:
+        # The supervisor stops the workers with SIGTERM, Ctrl-C reaches them directly
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        status = 0
+        try:
+            run()
+        except KeyboardInterrupt:
+            pass
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        # Never return into the code of the supervisor
+        os._exit(status)
+    return pid
+
+
+def _stop(signum, frame) -> None:
+    raise KeyboardInterrupt
+
+
+def prefork(workers: int, run: Callable[[], None], min_uptime: float = MIN_UPTIME) -> None:
+    """Run run in workers forked processes until interrupted, replacing every worker that exits.
+
+    A worker exiting less than min_uptime seconds after its start is replaced after
+    min_uptime, so a worker failing at startup does not make the supervisor spin. On
+    SIGINT or SIGTERM the workers are sent SIGTERM and waited for.
+    """
+    started = dict() # type: Dict[int, float]
+    previous = signal.signal(signal.SIGTERM, _stop)
+    try:
+        for _ in range(workers):
+            started[_spawn(run)] = time.monotonic()
+        while True:
+            pid, _ = os.wait()
+            if pid not in started:
+                continue
+            if time.monotonic() - started.pop(pid) < min_uptime:
+                time.sleep(min_uptime)
+            started[_spawn(run)] = time.monotonic()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+        for pid in started:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in started:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
@@ -6,13 +6,19 @@ import random
 import string
 import json
 import re
+import os
+import tempfile
+from sqlalchemy import text
 from hydrus.app import app_factory
+from hydrus.data import crud
+from hydrus.dispatch import compile_dispatch
 from hydrus.utils import Getter_setter
 from hydrus.data import doc_parse
 from hydrus.hydraspec import doc_writer_sample, doc_maker
-from sqlalchemy import create_engine
+from hydrus.data.engine import create_db_engine, pool_status
 from sqlalchemy.orm import sessionmaker, scoped_session
 from hydrus.data.db_models import Base
+import falcon
 from falcon import testing
 
 
@@ -38,8 +44,9 @@ class ViewsTestCase(testing.TestCase):
         """Database setup before the tests."""
         super(ViewsTestCase, self).setUp()
         print("Creating a temporary database...")
-        engine = create_engine('sqlite:///:memory:')
+        engine = create_db_engine('sqlite:///:memory:')
         Base.metadata.create_all(engine)
+        self.engine = engine
         self.session = scoped_session(sessionmaker(bind=engine))
         self.HYDRUS_SERVER_URL =  "http://hydrus.com"
         self.API_NAME = "demoapi"
@@ -106,6 +113,20 @@ class TestCases(ViewsTestCase):
         response_post = self.simulate_post("/"+self.API_NAME+"/vocab", json=dict(foo='bar'))
         assert response_post.status_code == 405
 
+    def test_Vocab_ETag(self):
+        """Test the vocab and contexts are revalidated with their ETag."""
+        for path in ["/vocab", "/contexts/EntryPoint.jsonld", "/contexts/dummyClassCollection.jsonld"]:
+            response_get = self.simulate_get("/" + self.API_NAME + path)
+            etag = response_get.headers["ETag"]
+            assert response_get.status_code == 200
+            assert "max-age" in response_get.headers["Cache-Control"]
+            response_cached = self.simulate_get("/" + self.API_NAME + path, headers={"If-None-Match": etag})
+            assert response_cached.status_code == 304
+            assert response_cached.text == ""
+            response_stale = self.simulate_get("/" + self.API_NAME + path, headers={"If-None-Match": '"stale"'})
+            assert response_stale.status_code == 200
+            assert response_stale.text == response_get.text
+
     def test_Collections_GET(self):
         """Test GET on collection endpoints."""
         index = self.simulate_get("/"+self.API_NAME)
@@ -134,6 +155,25 @@ class TestCases(ViewsTestCase):
                 good_response_put = self.simulate_put(endpoints[collection_name], json=dummy_object)
                 assert good_response_put.status_code == 201
 
+    def test_Collections_bulk(self):
+        """Test insert of many objects to a collection with a JSON array or NDJSON body."""
+        for collection_name in self.doc.collections:
+            class_ = self.doc.collections[collection_name]["collection"].class_.title
+            objects = [gen_dummy_object(class_, self.doc) for _ in range(3)]
+            bulk = "/" + self.API_NAME + "/" + collection_name + "/bulk"
+            response = self.simulate_post(bulk, body=json.dumps(objects))
+            assert response.status_code == 201
+            assert response.json["added"] == 3
+            ndjson = "\n".join(json.dumps(object_) for object_ in objects)
+            response = self.simulate_post(bulk, body=ndjson, headers={"Content-Type": "application/x-ndjson"})
+            assert response.status_code == 201
+            # The batch with an invalid object is rolled back as a whole
+            response = self.simulate_post(bulk, body=json.dumps(objects + [{"@type": "foo"}]))
+            assert response.status_code == 400
+            assert response.json["added"] == 0
+            members = crud.get_collection(self.API_NAME, class_, session=self.session, expand=True)["members"]
+            assert len([m for m in members if m["@type"] == class_]) == 6
+
     def test_object_POST(self):
         """Test replace of a given object using ID."""
         index = self.simulate_get("/"+self.API_NAME)
@@ -291,6 +331,96 @@ class TestCases(ViewsTestCase):
                     delete_response = self.simulate_delete(endpoints[collection_name]+'/'+id_)
                     assert delete_response.status_code == 405
 
+    def test_bad_cursors(self):
+        """Test a collection page cursor that is not an integer is rejected with 400."""
+        for collection_name in self.doc.collections:
+            collection = "/" + self.API_NAME + "/" + collection_name
+            for params in [{"after": "abc"}, {"before": "x"}, {"pageSize": "y"}]:
+                assert self.simulate_get(collection, params=params).status_code == 400
+
+    def test_session_released(self):
+        """Test the session of every request is released, streamed responses once they are read."""
+        self.session.remove()
+        for endpoint in self.doc.collections:
+            self.simulate_get("/" + self.API_NAME + "/" + endpoint)
+            assert pool_status(self.engine)["checked_out"] == 0
+            response_get = self.simulate_get("/" + self.API_NAME + "/" + endpoint, params={"stream": "true"})
+            assert response_get.status_code == 200
+            assert pool_status(self.engine)["checked_out"] == 0
+        assert pool_status(self.engine)["checkouts"] > 0
+
+    def test_concurrent_sessions(self):
+        """Test requests served at once, like the greenlets of one thread, do not share a session."""
+        responses = [falcon.Response(), falcon.Response()]
+        for resp in responses:
+            self.gs.process_request(None, resp)
+        first, second = [resp.context["db_session"] for resp in responses]
+        assert first is not second and self.session() not in [first, second]
+        first.execute(text("SELECT 1"))
+        # A streamed response keeps its session until it is read
+        responses[0].stream = iter([b"{}"])
+        self.gs.process_response(None, responses[0], None, True)
+        self.gs.process_response(None, responses[1], None, True)
+        assert first.in_transaction() and not second.in_transaction()
+        assert list(responses[0].stream) == [b"{}"]
+        assert not first.in_transaction()
+
+    def test_engine_pragmas(self):
+        """Test the journal mode and synchronous level are set on every SQLite connection."""
+        handle, path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        engine = create_db_engine("sqlite:///" + path, journal_mode="wal", synchronous="normal",
+                                  statement_cache_size=100)
+        try:
+            with engine.connect() as connection:
+                assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+                # 1 is NORMAL
+                assert connection.execute(text("PRAGMA synchronous")).scalar() == 1
+        finally:
+            engine.dispose()
+            os.remove(path)
+        with self.assertRaises(ValueError):
+            create_db_engine("sqlite://", journal_mode="fast")
+
+    def test_sqlite_profile(self):
+        """Test the pragmas of the tuned profile, and that explicit settings override them."""
+        handle, path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        tuned = create_db_engine("sqlite:///" + path, sqlite_profile="tuned")
+        rollback = create_db_engine("sqlite:///" + path, sqlite_profile="tuned", journal_mode="delete")
+        try:
+            with tuned.connect() as connection:
+                assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+                assert connection.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+                assert connection.execute(text("PRAGMA cache_size")).scalar() == -65536
+                # 2 is MEMORY
+                assert connection.execute(text("PRAGMA temp_store")).scalar() == 2
+            tuned.dispose()
+            with rollback.connect() as connection:
+                assert connection.execute(text("PRAGMA journal_mode")).scalar() == "delete"
+                assert connection.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+        finally:
+            tuned.dispose()
+            rollback.dispose()
+            os.remove(path)
+        with self.assertRaises(ValueError):
+            create_db_engine("sqlite://", sqlite_profile="fast")
+
+    def test_dispatch_table(self):
+        """Test the dispatch table compiled from the API Documentation."""
+        dispatch = compile_dispatch(self.doc)
+        route = dispatch.routes["dummyClassCollection"]
+        assert route.collection
+        assert route.class_ == "dummyClass"
+        assert route.methods == frozenset(["GET", "PUT"])
+        assert dispatch.collections["dummyClassCollection"] == "dummyClass"
+        assert dict(dispatch.operations["dummyClass"]) == {"POST": "dummyClass"}
+        assert "dummyClass" not in dispatch.singles
+        assert dispatch.properties["dummyClass"] == (("Prop1", "http://hydrus.com/prop1"),
+                                                     ("Prop2", "http://hydrus.com/prop1"))
+        with self.assertRaises(TypeError):
+            dispatch.routes["dummyClass"] = route
+
     def test_Endpoints_Contexts(self):
         """Test all endpoints contexts are generated properly."""
         index = self.simulate_get("/"+self.API_NAME)
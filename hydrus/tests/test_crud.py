@@ -1,17 +1,30 @@
 """Unit tests for CRUD operations in hydrus.data.crud."""
 
+import os
+import tempfile
+import threading
 import unittest
 
 
 from falcon import testing, HTTP_404, HTTP_400
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.orm import sessionmaker,scoped_session
 import hydrus.data.crud as crud
-from hydrus.data.db_models import Base
+from hydrus.data.bulk import insert_many
+from hydrus.data.export import export, export_objects
+from hydrus.data.filters import filter_params, search_template
+from hydrus.data.maintenance import create_tables, migrate, move_terminals, optimize
+from hydrus.data.store import configure_layout, get_store, reserve_ids, set_layout
+from hydrus.data.schema import get_schema
+from hydrus.data.db_models import Base, BaseProperty, Instance, Setting
+from hydrus.data.engine import create_db_engine
 from hydrus.data import doc_parse
+from hydrus.hydraspec import doc_maker
+from hydrus.hydraspec.doc_writer import HydraDoc, HydraClass, HydraClassProp
 from hydrus.hydraspec.doc_writer_sample import api_doc as doc
 import random
 import string
+import json
 import pdb
 
 
@@ -42,6 +55,7 @@ class TestCRUD(testing.TestCase):
         Base.metadata.create_all(engine)
         session = scoped_session(sessionmaker(bind=engine))
 
+        self.engine = engine
         self.session = session
         self.doc = doc
         test_classes = doc_parse.get_classes(self.doc.generate())
@@ -54,6 +68,9 @@ class TestCRUD(testing.TestCase):
 
 class TestCases(TestCRUD):
 
+    # INSERT statements of one bulk insert: instances, terminals, graph, graphiii and graphiit
+    bulk_inserts = 5
+
     def test_insert(self):
         """Test CRUD insert."""
         object_ = gen_dummy_object("dummyClass", self.doc)
@@ -69,6 +86,261 @@ class TestCases(TestCRUD):
         assert type(response) is int
         assert int(object_["@id"].split("/")[-1]) == id_
 
+    def test_get_nested(self):
+        """Test CRUD get on nested objects uses a fixed number of queries."""
+        object_ = gen_dummy_object("dummyClass", self.doc)
+        object_["Prop1"] = gen_dummy_object("dummyClass", self.doc)
+        object_["Prop1"]["Prop1"] = gen_dummy_object("dummyClass", self.doc)
+        id_ = 8
+        crud.insert(object_=object_, id_=id_, session=self.session)
+        statements = list()
+        event.listen(self.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        response = crud.get(id_=id_, type_=object_["@type"], session=self.session, api_name="api")
+        assert response.pop("@id") == "/api/dummyClassCollection/8"
+        assert response == object_
+        assert len(statements) <= 6
+
+    def test_get_collection_expand(self):
+        """Test CRUD get_collection with members expanded in a fixed number of queries."""
+        objects = [gen_dummy_object("dummyClass", self.doc) for _ in range(5)]
+        for id_, object_ in enumerate(objects, start=10):
+            crud.insert(object_=object_, id_=id_, session=self.session)
+        statements = list()
+        event.listen(self.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        response = crud.get_collection("api", "dummyClass", session=self.session, expand=True)
+        assert len(response["members"]) == len(objects)
+        for member, object_ in zip(response["members"], objects):
+            assert member.pop("@id") == "/api/dummyClassCollection/" + str(objects.index(object_) + 10)
+            assert member == object_
+        assert len(statements) <= 6
+
+    def test_get_collection_pages(self):
+        """Test CRUD get_collection keyset pagination and PartialCollectionView."""
+        for id_ in range(20, 27):
+            crud.insert(object_=gen_dummy_object("dummyClass", self.doc), id_=id_, session=self.session)
+        first = crud.get_collection("api", "dummyClass", session=self.session, page_size=3)
+        assert [m["@id"] for m in first["members"]] == ["/api/dummyClassCollection/" + str(i) for i in (20, 21, 22)]
+        assert first["view"]["@type"] == "PartialCollectionView"
+        assert first["view"]["next"] == "/api/dummyClassCollection?pageSize=3&after=22"
+        assert first["view"]["last"] == "/api/dummyClassCollection?pageSize=3&before=27"
+        assert "previous" not in first["view"]
+        second = crud.get_collection("api", "dummyClass", session=self.session, page_size=3, after=22)
+        assert [m["@id"].split("/")[-1] for m in second["members"]] == ["23", "24", "25"]
+        assert second["view"]["previous"] == "/api/dummyClassCollection?pageSize=3&before=23"
+        last = crud.get_collection("api", "dummyClass", session=self.session, page_size=3, before=27)
+        assert [m["@id"].split("/")[-1] for m in last["members"]] == ["24", "25", "26"]
+        assert "next" not in last["view"]
+        previous = crud.get_collection("api", "dummyClass", session=self.session, page_size=3, before=23,
+                                       expand=True)
+        assert [m["@id"].split("/")[-1] for m in previous["members"]] == ["20", "21", "22"]
+        assert "Prop1" in previous["members"][0]
+        assert "previous" not in previous["view"]
+
+    def test_stream_collection(self):
+        """Test CRUD stream_collection writes the same members as get_collection."""
+        for id_ in range(40, 45):
+            crud.insert(object_=gen_dummy_object("dummyClass", self.doc), id_=id_, session=self.session)
+        chunks = list(crud.stream_collection("api", "dummyClass", session=self.session, expand=True, batch_size=2))
+        assert len(chunks) == 5
+        response = json.loads(b"".join(chunks).decode("utf-8"))
+        assert response == crud.get_collection("api", "dummyClass", session=self.session, expand=True)
+        links = json.loads(b"".join(crud.stream_collection("api", "dummyClass", session=self.session,
+                                                           batch_size=2)).decode("utf-8"))
+        assert links["members"][0] == {"@id": "/api/dummyClassCollection/40", "@type": "dummyClass"}
+
+    def test_schema_cache(self):
+        """Test the schema is cached until classes or properties change."""
+        schema = get_schema(self.session)
+        assert get_schema(self.session) is schema
+        assert schema.properties["Prop1"][1] == "PROPERTY"
+        crud.insert(object_=gen_dummy_object("dummyClass", self.doc), id_=9, session=self.session)
+        assert get_schema(self.session) is not schema
+        assert get_schema(self.session).properties["Prop1"][1] == "INSTANCE"
+        doc_parse.insert_properties({"Prop3"}, self.session)
+        assert "Prop3" in get_schema(self.session).properties
+
+    def test_schema_cache_rollback(self):
+        """Test a property type set by a rolled back update is not kept in the cached schema."""
+        doc_parse.insert_properties({"Prop3"}, self.session)
+        crud.insert(object_={"@type": "dummyClass", "Prop1": "v"}, id_=9, session=self.session)
+        response_code = None
+        try:
+            crud.update(id_=9, type_="dummyClass", object_={"@type": "dummyClass", "Prop3": "x", "Prop1": "w",
+                                                                  "Prop9": "y"},
+                        session=self.session, api_name="api")
+        except Exception as e:
+            response_code, message = e.get_HTTP()
+        assert HTTP_400 == response_code
+        stored = self.session.query(BaseProperty.type_).filter(BaseProperty.name == "Prop3").scalar()
+        assert stored == "PROPERTY"
+        assert get_schema(self.session).properties["Prop3"][1] == stored
+        # The property can still be used for a class, as the database allows
+        crud.update(id_=9, type_="dummyClass", object_={"@type": "dummyClass", "Prop3": "dummyClass"},
+                    session=self.session, api_name="api")
+        assert get_schema(self.session).properties["Prop3"][1] == "ABSTRACT"
+
+    def test_typed_values(self):
+        """Test values of properties with a typed range are stored and read back as numbers."""
+        classes = [{"supportedProperty": [{"title": "Prop1", "property": "http://hydrus.com/prop1"},
+                                          {"title": "Prop2", "property": {"@id": "http://hydrus.com/prop2",
+                                                                          "range": "xsd:integer"}}]}]
+        assert doc_parse.get_property_ranges(classes) == {"Prop2": "xsd:integer"}
+        doc_parse.insert_properties({"Prop2"}, self.session, doc_parse.get_property_ranges(classes))
+        assert get_schema(self.session).datatypes[get_schema(self.session).properties["Prop2"][0]] == "integer"
+        crud.insert(object_={"@type": "dummyClass", "Prop1": "a", "Prop2": "12"}, id_=70, session=self.session)
+        insert_many([{"@type": "dummyClass", "Prop1": "b", "Prop2": 5}], self.session)
+        assert crud.get(id_=70, type_="dummyClass", session=self.session, api_name="api")["Prop2"] == 12
+        assert crud.get(id_=71, type_="dummyClass", session=self.session, api_name="api")["Prop2"] == 5
+        # Integers beyond 2^53 are not rounded by their float index
+        crud.insert(object_={"@type": "dummyClass", "Prop1": "c", "Prop2": 9007199254740993}, id_=72,
+                    session=self.session)
+        assert crud.get(id_=72, type_="dummyClass", session=self.session, api_name="api")["Prop2"] == 9007199254740993
+        response_code = None
+        try:
+            crud.insert(object_={"@type": "dummyClass", "Prop2": "fast"}, session=self.session)
+        except Exception as e:
+            response_code, message = e.get_HTTP()
+        assert HTTP_400 == response_code
+        response_code = None
+        try:
+            insert_many([{"@type": "dummyClass", "Prop2": 2.5}], self.session)
+        except Exception as e:
+            response_code, message = e.get_HTTP()
+        assert HTTP_400 == response_code
+        # Values that are not numbers, or beyond the range of the number column
+        for value in [None, [1], 10**400]:
+            for insert in [lambda object_: crud.insert(object_=object_, session=self.session),
+                           lambda object_: insert_many([object_], self.session)]:
+                response_code = None
+                try:
+                    insert({"@type": "dummyClass", "Prop2": value})
+                except Exception as e:
+                    response_code, message = e.get_HTTP()
+                assert HTTP_400 == response_code
+
+    def test_range_filters(self):
+        """Test get_collection only returns the members whose values are in the range."""
+        doc_parse.insert_properties({"Prop2"}, self.session, {"Prop2": "xsd:integer"})
+        insert_many([{"@type": "dummyClass", "Prop1": "a", "Prop2": value} for value in [3, 10, 25, 40]],
+                    self.session)
+        members = crud.get_collection("api", "dummyClass", session=self.session, expand=True,
+                                      filters={"Prop2[gt]": "9", "Prop2[lte]": "25"})["members"]
+        assert [member["Prop2"] for member in members] == [10, 25]
+        page = crud.get_collection("api", "dummyClass", session=self.session, page_size=1,
+                                   filters={"Prop2[gte]": "10"})
+        assert page["view"]["next"].endswith("&Prop2%5Bgte%5D=10")
+        streamed = json.loads(b"".join(crud.stream_collection("api", "dummyClass", session=self.session,
+                                                              filters={"Prop2[lt]": "10"})).decode("utf-8"))
+        assert len(streamed["members"]) == 1
+        for filters in [{"Prop1[gt]": "1"}, {"Prop2[gt]": "x"}, {"Prop2[ne]": "1"}, {"Prop9[gt]": "1"}]:
+            response_code = None
+            try:
+                crud.get_collection("api", "dummyClass", session=self.session, filters=filters)
+            except Exception as e:
+                response_code, message = e.get_HTTP()
+            assert HTTP_400 == response_code
+
+    def test_doc_ranges(self):
+        """Test the ranges of a HydraDoc built with doc_writer give typed storage and range filters."""
+        typed_doc = HydraDoc("typedapi", "Typed API", "An API with typed properties", "api", "http://hydrus.com/")
+        class_ = HydraClass("http://hydrus.com/typedClass", "typedClass", "A class with a typed property")
+        class_.add_supported_prop(HydraClassProp("http://hydrus.com/count", "Count", read=False, write=True,
+                                                 required=False, range_="xsd:integer"))
+        typed_doc.add_supported_class(class_, collection=True)
+        typed_doc.add_baseResource()
+        typed_doc.add_baseCollection()
+        typed_doc.gen_EntryPoint()
+        # The range survives a round trip through the generated document
+        typed_doc = doc_maker.create_doc(typed_doc.generate(), "http://hydrus.com/", "typedapi")
+        classes = doc_parse.get_classes(typed_doc.generate())
+        assert doc_parse.get_property_ranges(classes) == {"Count": "xsd:integer"}
+        doc_parse.insert_classes(classes, self.session)
+        doc_parse.insert_properties(doc_parse.get_all_properties(classes), self.session,
+                                    doc_parse.get_property_ranges(classes))
+        insert_many([{"@type": "typedClass", "Count": count} for count in [9, 10, 100]], self.session)
+        members = crud.get_collection("api", "typedClass", session=self.session, expand=True,
+                                      filters={"Count[gte]": "10"})["members"]
+        assert [member["Count"] for member in members] == [10, 100]
+
+    def test_filters(self):
+        """Test get_collection only returns the members matching equality, prefix, IN and nested filters."""
+        doc_parse.insert_properties({"Prop2"}, self.session, {"Prop2": "xsd:integer"})
+        names = ["alpha", "beta", "alps", "al%x"]
+        objects = [{"@type": "dummyClass", "Prop1": {"@type": "dummyClass", "Prop1": name, "Prop2": index},
+                    "Prop2": index * 10} for index, name in enumerate(names)]
+        ids = insert_many(objects, self.session)
+
+        def members(filters):
+            collection = crud.get_collection("api", "dummyClass", session=self.session, filters=filters)
+            return [int(member["@id"].split("/")[-1]) for member in collection["members"]]
+
+        assert members({"Prop2": "10"}) == [ids[1]]
+        assert members({"Prop2": ["10", "30"]}) == [ids[1], ids[3]]
+        assert members({"Prop2[in]": "10,20"}) == [ids[1], ids[2]]
+        assert members({"Prop1.Prop1": "beta"}) == [ids[1]]
+        assert members({"Prop1.Prop1[prefix]": "al"}) == [ids[0], ids[2], ids[3]]
+        assert members({"Prop1.Prop1[prefix]": "al%"}) == [ids[3]]
+        assert members({"Prop1.Prop2[gte]": "2", "Prop2[lt]": "30"}) == [ids[2]]
+        response_code = None
+        try:
+            members({"Prop1[prefix]": ""})
+        except Exception as e:
+            response_code, message = e.get_HTTP()
+        assert HTTP_400 == response_code
+
+        template = search_template("/api/dummyClassCollection/", [("Prop1", "vocab:Prop1"), ("Prop2", "vocab:Prop2")],
+                                   get_schema(self.session))
+        assert template["@type"] == "IriTemplate"
+        assert template["template"].startswith("/api/dummyClassCollection{?Prop1,Prop1%5Bin%5D,")
+        variables = [mapping["variable"] for mapping in template["mapping"]]
+        assert "Prop2%5Bgt%5D" in variables and "Prop1%5Bgt%5D" not in variables
+        # No filter matches the nested objects of a property whose IRI is a class
+        template = search_template("/api/dummyClassCollection/", [("Prop1", "vocab:dummyClass")],
+                                   get_schema(self.session))
+        assert template["mapping"] == []
+
+        params = {"Prop1": "a", "Prop1.Prop2[gte]": "2", "Prop9[gt]": "1", "pageSize": "2", "_": "1",
+                  "utm_source": "x", "pagesize": "2"}
+        assert filter_params(params, get_schema(self.session)) == {"Prop1": "a", "Prop1.Prop2[gte]": "2",
+                                                                  "Prop9[gt]": "1"}
+
+    def test_insert_many(self):
+        """Test bulk insert writes the same objects as CRUD insert with one statement per table."""
+        objects = [gen_dummy_object("dummyClass", self.doc) for _ in range(4)]
+        objects[0]["Prop1"] = gen_dummy_object("dummyClass", self.doc)
+        crud.insert(object_=gen_dummy_object("dummyClass", self.doc), id_=60, session=self.session)
+        statements = list()
+        event.listen(self.engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        ids = insert_many(objects, self.session, type_="dummyClass")
+        assert ids == [61, 63, 64, 65]
+        assert len([s for s in statements if s.startswith("INSERT")]) == self.bulk_inserts
+        for id_, object_ in zip(ids, objects):
+            response = crud.get(id_=id_, type_="dummyClass", session=self.session, api_name="api")
+            assert response.pop("@id") == "/api/dummyClassCollection/" + str(id_)
+            assert response == object_
+        response_code = None
+        try:
+            insert_many([objects[0], {"@type": "dummyClass", "Prop9": "x"}], self.session)
+        except Exception as e:
+            response_code, message = e.get_HTTP()
+        assert HTTP_400 == response_code
+        assert crud.get_collection("api", "dummyClass", session=self.session)["members"][-1]["@id"].endswith("/65")
+
+    def test_export(self):
+        """Test export writes every top level object once, with its nested objects."""
+        objects = [gen_dummy_object("dummyClass", self.doc) for _ in range(3)]
+        objects[1]["Prop1"] = gen_dummy_object("dummyClass", self.doc)
+        ids = insert_many(objects, self.session)
+        exported = list(export_objects("api", self.session, batch_size=2))
+        assert [object_.pop("@id") for object_ in exported] == ["/api/dummyClassCollection/" + str(i) for i in ids]
+        assert exported == objects
+        lines = "".join(export("api", self.session, "ndjson", "dummyClass")).splitlines()
+        assert [json.loads(line)["@id"].split("/")[-1] for line in lines] == [str(i) for i in ids]
+        triples = "".join(export("api", self.session, "ntriples", batch_size=1)).splitlines()
+        # A type triple per instance and a triple per property
+        assert len(triples) == 4 + sum(len(object_) - 1 for object_ in objects) + len(objects[1]["Prop1"]) - 1
+        assert all(triple.endswith(" .") for triple in triples)
+
     def test_update(self):
         """Test CRUD update."""
         object_ = gen_dummy_object("dummyClass", self.doc)
@@ -82,6 +354,54 @@ class TestCases(TestCRUD):
         assert insert_response == update_response
         assert int(test_object["@id"].split("/")[-1]) == id_
 
+    def test_update_diff(self):
+        """Test CRUD update only rewrites the triples that changed and keeps nested instances."""
+        object_ = {"@type": "dummyClass", "Prop1": {"@type": "dummyClass", "Prop1": "a", "Prop2": "b"}, "Prop2": "c"}
+        crud.insert(object_=object_, id_=31, session=self.session)
+        statements = list()
+        listener = lambda *args: statements.append(args[2])
+        event.listen(self.engine, "before_cursor_execute", listener)
+        crud.update(id_=31, type_="dummyClass", object_=object_, session=self.session, api_name="api")
+        event.remove(self.engine, "before_cursor_execute", listener)
+        assert not [statement for statement in statements if statement.split()[0] in ["INSERT", "DELETE", "UPDATE"]]
+
+        members = len(crud.get_collection("api", "dummyClass", session=self.session)["members"])
+        new_object = {"@type": "dummyClass", "Prop1": {"@type": "dummyClass", "Prop1": "d", "Prop2": "b"}}
+        crud.update(id_=31, type_="dummyClass", object_=new_object, session=self.session, api_name="api")
+        response = crud.get(id_=31, type_="dummyClass", session=self.session, api_name="api")
+        assert response["Prop1"] == new_object["Prop1"]
+        assert "Prop2" not in response
+        # The nested object was updated in place
+        assert len(crud.get_collection("api", "dummyClass", session=self.session)["members"]) == members
+
+        response_code = None
+        try:
+            crud.update(id_=31, type_="dummyClass", object_={"@type": "dummyClass", "Prop2": "e", "Prop9": "f"},
+                        session=self.session, api_name="api")
+        except Exception as e:
+            response_code, message = e.get_HTTP()
+        assert HTTP_400 == response_code
+        response = crud.get(id_=31, type_="dummyClass", session=self.session, api_name="api")
+        assert response["Prop1"] == new_object["Prop1"] and "Prop2" not in response
+
+    def test_single(self):
+        """Test the single object functions use the newest instance of the class."""
+        doc_parse.insert_classes([{"title": "singleClass"}], self.session)
+        response_code = None
+        try:
+            crud.get_single("singleClass", api_name="api", session=self.session)
+        except Exception as e:
+            response_code, message = e.get_HTTP()
+        assert HTTP_404 == response_code
+        crud.insert_single({"@type": "singleClass", "Prop2": "a"}, session=self.session)
+        # A stale duplicate, the single functions must use the newest instance
+        crud.insert({"@type": "singleClass", "Prop2": "b"}, id_=200, session=self.session)
+        assert crud.get_single("singleClass", api_name="api", session=self.session)["Prop2"] == "b"
+        crud.update_single({"@type": "singleClass", "Prop2": "c"}, session=self.session, api_name="api")
+        assert crud.get(id_=200, type_="singleClass", session=self.session, api_name="api")["Prop2"] == "c"
+        crud.delete_single("singleClass", session=self.session)
+        assert crud.get_single("singleClass", api_name="api", session=self.session)["Prop2"] == "a"
+
     def test_delete(self):
         """Test CRUD delete."""
         object_ = gen_dummy_object("dummyClass", self.doc)
@@ -119,6 +439,42 @@ class TestCases(TestCRUD):
             response_code, message = e.get_HTTP()
         assert HTTP_400 == response_code
 
+    def test_delete_nested(self):
+        """Test CRUD delete removes nested instances and their triples with a fixed number of statements."""
+        def nested(depth):
+            object_ = gen_dummy_object("dummyClass", self.doc)
+            if depth > 1:
+                object_["Prop1"] = nested(depth - 1)
+            return object_
+
+        counts = list()
+        crud.insert(object_=nested(2), id_=80, session=self.session)
+        crud.insert(object_=nested(6), id_=90, session=self.session)
+        for id_ in [80, 90]:
+            statements = list()
+            listener = lambda *args: statements.append(args[2])
+            event.listen(self.engine, "before_cursor_execute", listener)
+            crud.delete(id_=id_, type_="dummyClass", session=self.session)
+            event.remove(self.engine, "before_cursor_execute", listener)
+            counts.append(len(statements))
+        assert counts[0] == counts[1]
+        assert crud.get_collection("api", "dummyClass", session=self.session)["members"] == []
+        for kind in ["graphiii", "graphiit"]:
+            edges = get_store(self.session).edges(kind)
+            assert self.session.query(edges).count() == 0
+
+    def test_delete_other_class(self):
+        """Test CRUD delete does not delete an instance of another class with the given ID."""
+        doc_parse.insert_classes([{"title": "otherClass"}], self.session)
+        crud.insert(object_=gen_dummy_object("dummyClass", self.doc), id_=51, session=self.session)
+        response_code = None
+        try:
+            crud.delete(id_=51, type_="otherClass", session=self.session)
+        except Exception as e:
+            response_code, message = e.get_HTTP()
+        assert HTTP_404 == response_code
+        assert crud.get(id_=51, type_="dummyClass", session=self.session, api_name="api")
+
     def test_delete_type(self):
         """Test CRUD delete when wrong/undefined class is given."""
         object_ = gen_dummy_object("dummyClass", self.doc)
@@ -171,6 +527,167 @@ class TestCases(TestCRUD):
             response_code, message = e.get_HTTP()
         assert HTTP_400 == response_code
 
+    def test_migrate(self):
+        """Test triples are moved between storage layouts without changing any object."""
+        objects = [gen_dummy_object("dummyClass", self.doc) for _ in range(3)]
+        objects[0]["Prop1"] = gen_dummy_object("dummyClass", self.doc)
+        insert_many(objects, self.session)
+        exported = list(export_objects("api", self.session))
+        layout = get_store(self.session).layout
+        other = "joined" if layout == "triples" else "triples"
+        assert migrate(self.session, other) == 8
+        assert get_store(self.session).layout == other
+        assert list(export_objects("api", self.session)) == exported
+        assert migrate(self.session, layout) == 8
+        assert list(export_objects("api", self.session)) == exported
+
+    def test_move_terminals(self):
+        """Test literal values are moved inline and back without changing any object."""
+        objects = [gen_dummy_object("dummyClass", self.doc) for _ in range(3)]
+        insert_many(objects, self.session)
+        exported = list(export_objects("api", self.session))
+        inline = get_store(self.session).inline_terminals
+        assert move_terminals(self.session, not inline) > 0
+        assert get_store(self.session).inline_terminals != inline
+        assert list(export_objects("api", self.session)) == exported
+        assert move_terminals(self.session, not inline) == 0
+        assert move_terminals(self.session, inline) > 0
+        assert list(export_objects("api", self.session)) == exported
+
+    def test_optimize(self):
+        """Test optimize creates the declared indexes missing from an existing database."""
+        self.session.execute(text("DROP INDEX ix_graphiit_subject_predicate"))
+        self.session.commit()
+        report = optimize(self.session)
+        assert report["created"] == ["ix_graphiit_subject_predicate"]
+        assert optimize(self.session)["created"] == []
+        tables = dict((table["name"], table) for table in report["tables"])
+        assert "ix_instances_type_id" in tables["instances"]["indexes"]
+
+
+class TriplesTestCases(TestCases):
+    """Run the CRUD tests against the single table storage layout."""
+
+    # instances, terminals and triples
+    bulk_inserts = 3
+
+    def setUp(self):
+        """Select the triples layout for the test database."""
+        super(TriplesTestCases, self).setUp()
+        set_layout(self.engine, "triples")
+
+
+class InlineTestCases(TestCases):
+    """Run the CRUD tests with the literal values stored on the graphiit triples."""
+
+    # instances, graph, graphiii and graphiit
+    bulk_inserts = 4
+
+    def setUp(self):
+        """Keep the literal values of the test database inline."""
+        super(InlineTestCases, self).setUp()
+        set_layout(self.engine, "joined", inline_terminals=True)
+
+
+class TriplesInlineTestCases(TestCases):
+    """Run the CRUD tests with the literal values stored inline in the triples table."""
+
+    # instances and triples
+    bulk_inserts = 2
+
+    def setUp(self):
+        """Select the triples layout with inline literal values."""
+        super(TriplesInlineTestCases, self).setUp()
+        set_layout(self.engine, "triples", inline_terminals=True)
+
+
+class TestFile(unittest.TestCase):
+    """Base class for the tests needing a database file, opened by several engines or threads."""
+
+    def setUp(self):
+        """Create the database file with the classes and properties of the sample doc."""
+        handle, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        self.engine = create_db_engine("sqlite:///" + self.path)
+        create_tables(self.engine)
+        session = scoped_session(sessionmaker(bind=self.engine))
+        classes = doc_parse.get_classes(doc.generate())
+        doc_parse.insert_classes(classes, session)
+        doc_parse.insert_properties(doc_parse.get_all_properties(classes), session)
+        session.remove()
+
+    def tearDown(self):
+        """Remove the database file."""
+        self.engine.dispose()
+        os.remove(self.path)
+
+    def session(self):
+        """Return a session of a new engine on the database file, with nothing cached."""
+        return scoped_session(sessionmaker(bind=create_db_engine("sqlite:///" + self.path)))
+
+
+class LayoutTestCases(TestFile):
+    """Test the storage layout recorded in the database."""
+
+    def test_configure_layout(self):
+        """Test a new database records the layout asked for and an existing one refuses others."""
+        session = self.session()
+        store = configure_layout(session, "triples", inline_terminals=True)
+        assert (store.layout, store.inline_terminals) == ("triples", True)
+        ids = insert_many([{"@type": "dummyClass", "Prop1": "a"}], session)
+
+        session = self.session()
+        store = get_store(session)
+        assert (store.layout, store.inline_terminals) == ("triples", True)
+        # The recorded inline mode is kept when only the layout is given
+        assert configure_layout(session, "triples").inline_terminals
+        assert crud.get(ids[0], "dummyClass", api_name="api", session=session)["Prop1"] == "a"
+        for layout, inline_terminals in [("joined", None), (None, False)]:
+            with self.assertRaises(ValueError):
+                configure_layout(session, layout, inline_terminals)
+
+        migrate(session, "joined")
+        move_terminals(session, False)
+        session = self.session()
+        with self.assertRaises(ValueError):
+            configure_layout(session, "triples")
+        store = configure_layout(session)
+        assert (store.layout, store.inline_terminals) == ("joined", False)
+
+    def test_detected_layout(self):
+        """Test the layout of a database written before it was recorded is detected from its triples."""
+        session = self.session()
+        set_layout(session.get_bind().engine, "triples", inline_terminals=True)
+        insert_many([{"@type": "dummyClass", "Prop1": "a"}], session)
+        session = self.session()
+        with self.assertRaises(ValueError):
+            configure_layout(session, "triples", inline_terminals=False)
+        store = configure_layout(session, "triples")
+        assert (store.layout, store.inline_terminals) == ("triples", True)
+        assert session.query(Setting.value).filter(Setting.name == "terminals").scalar() == "inline"
+
+
+class ReserveIdsTestCases(TestFile):
+    """Test bulk inserts of concurrent transactions get distinct IDs."""
+
+    def test_concurrent_reservations(self):
+        """Test a transaction reserving IDs makes the other writers wait until it ends."""
+        first = sessionmaker(bind=self.engine)()
+        ids = reserve_ids(first, "instances", 2)
+        inserted = list()
+        second = threading.Thread(target=lambda: inserted.append(insert_many(
+            [{"@type": "dummyClass", "Prop1": "b"}], sessionmaker(bind=self.engine)())))
+        second.start()
+        second.join(0.5)
+        # The second bulk insert waits for the write lock
+        assert second.is_alive()
+        class_id = get_schema(first).class_id("dummyClass")
+        first.execute(Instance.__table__.insert(), [{"id": id_, "type_": class_id} for id_ in ids])
+        first.commit()
+        first.close()
+        second.join()
+        assert ids == [1, 2]
+        assert inserted == [[3]]
 
 
 if __name__ == '__main__':
@@ -0,0 +1,81 @@
+"""Tests for the supervision of pre-forked workers."""
+
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import time
+import unittest
+from hydrus.prefork import listen, prefork
+
+
+def wait_for(condition, timeout=10.0):
+    """Wait until condition() is true, fail after timeout seconds."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+def alive(pid):
+    """Check if a process exists."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+class PreforkTestCase(unittest.TestCase):
+    """Test workers are forked, replaced and stopped."""
+
+    def setUp(self):
+        """Create the directory the workers write their PIDs to."""
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove the directory."""
+        shutil.rmtree(self.directory)
+
+    def worker(self):
+        """Write the PID of the worker and wait to be stopped."""
+        open(os.path.join(self.directory, str(os.getpid())), "w").close()
+        while True:
+            time.sleep(1)
+
+    def pids(self):
+        """Return the PIDs of every worker started so far."""
+        return set(int(name) for name in os.listdir(self.directory))
+
+    def test_supervision(self):
+        """Test an exited worker is replaced and every worker stops with the supervisor."""
+        supervisor = os.fork()
+        if supervisor == 0:
+            try:
+                prefork(2, self.worker, min_uptime=0)
+            finally:
+                os._exit(0)
+
+        wait_for(lambda: len(self.pids()) == 2)
+        first = self.pids()
+        os.kill(sorted(first)[0], signal.SIGKILL)
+        wait_for(lambda: len(self.pids()) == 3)
+
+        os.kill(supervisor, signal.SIGTERM)
+        os.waitpid(supervisor, 0)
+        assert not any(alive(pid) for pid in self.pids())
+
+    def test_listen(self):
+        """Test the listening socket accepts connections."""
+        listener = listen(0, host="127.0.0.1")
+        client = socket.create_connection(listener.getsockname())
+        listener.setblocking(True)
+        connection, _ = listener.accept()
+        connection.close()
+        client.close()
+        listener.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
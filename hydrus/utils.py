@@ -2,28 +2,80 @@
 
 
 from hydrus.hydraspec import doc_writer_sample
-from hydrus.data.db_models import engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.scoping import scoped_session
 from hydrus.hydraspec.doc_writer import HydraDoc
+from hydrus.dispatch import DispatchTable, compile_dispatch
+from hydrus.documents import RenderedDocs, render_docs
 import falcon
-from typing import Any, Iterator
+from typing import Any, Iterable, Iterator, Optional
+
+# Sessions handed out by get_session when no Getter_setter is in use, an application
+# without one binds them with Session.configure(bind=engine)
+Session = scoped_session(sessionmaker())
 
 
 class Getter_setter(object):
-    def __init__(self, db_session, hydrus_server_url: str, api_name, api_doc: HydraDoc, authentication: bool):
+    def __init__(self, db_session, hydrus_server_url: str, api_name, api_doc: HydraDoc, authentication: bool,
+                 page_size: int = 50, max_page_size: int = 500):
+        # A sessionmaker, or a scoped_session whose factory is used: every request gets its own session
         self.db_session = db_session
         self.hydrus_server_url = hydrus_server_url
         self.api_name = api_name
         self.api_doc = api_doc
         self.authentication = authentication
+        # Default and hard cap of members per collection page
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+        # Compiled from api_doc by app_factory
+        self.dispatch = None # type: Optional[DispatchTable]
+        # Rendered from api_doc by app_factory
+        self.documents = None # type: Optional[RenderedDocs]
+
+    def new_session(self):
+        """Return a new session for a request.
+
+        A scoped_session would hand the same session to the requests served concurrently
+        by the greenlets of one thread, so only its factory is used.
+        """
+        return getattr(self.db_session, 'session_factory', self.db_session)()
 
     def process_request(self, req, resp):
-        resp.context['db_session'] = self.db_session()
+        resp.context['db_session'] = self.new_session()
         resp.context['hydrus_server_url'] = self.hydrus_server_url
         resp.context['api_name'] = self.api_name
         resp.context['api_doc'] = self.api_doc
         resp.context['authentication'] = self.authentication
+        resp.context['page_size'] = self.page_size
+        resp.context['max_page_size'] = self.max_page_size
+        if self.dispatch is not None:
+            resp.context['dispatch'] = self.dispatch
+        if self.documents is not None:
+            resp.context['documents'] = self.documents
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        session = resp.context.get('db_session')
+        if session is None:
+            return
+        if not req_succeeded:
+            session.rollback()
+        if resp.stream is not None:
+            # A streamed body is read from the database while it is sent
+            resp.stream = self._release_after(resp.stream, session)
+        else:
+            self.release(session)
+
+    def release(self, session) -> None:
+        """Close the session of a request and return its connection to the pool."""
+        session.close()
+
+    def _release_after(self, stream: Iterable[bytes], session) -> Iterator[bytes]:
+        """Release the session once the stream is exhausted or closed by the server."""
+        try:
+            for chunk in stream:
+                yield chunk
+        finally:
+            self.release(session)
 
 
 
@@ -34,6 +86,22 @@ def get_doc(resp):
         apidoc = resp.context['api_doc'] = doc_writer_sample.api_doc
     return apidoc
 
+def get_dispatch(resp) -> DispatchTable:
+    """Get the dispatch table compiled from the API Documentation."""
+    try:
+        dispatch = resp.context['dispatch']
+    except KeyError:
+        dispatch = resp.context['dispatch'] = compile_dispatch(get_doc(resp))
+    return dispatch
+
+def get_documents(resp) -> RenderedDocs:
+    """Get the documents rendered from the API Documentation."""
+    try:
+        documents = resp.context['documents']
+    except KeyError:
+        documents = resp.context['documents'] = render_docs(get_doc(resp))
+    return documents
+
 def get_authentication(resp) -> bool:
     """Check wether API needs to be authenticated or not."""
     try:
@@ -59,13 +127,28 @@ def get_hydrus_server_url(resp) -> str:
 
     return hydrus_server_url
 
+def get_page_size(resp) -> int:
+    """Get the default number of members in a collection page."""
+    try:
+        page_size = resp.context['page_size']
+    except KeyError:
+        page_size = resp.context['page_size'] = 50
+    return page_size
+
+def get_max_page_size(resp) -> int:
+    """Get the maximum number of members a client may request in a collection page."""
+    try:
+        max_page_size = resp.context['max_page_size']
+    except KeyError:
+        max_page_size = resp.context['max_page_size'] = 500
+    return max_page_size
+
 def get_session(resp) -> scoped_session:
     """Get the Database Session for the server."""
     try:
         session = resp.context['db_session']
     except KeyError:
-        session = scoped_session(sessionmaker(bind=engine))
-        session = resp.context['db_session'] = session()
+        session = resp.context['db_session'] = Session()
     return session
 
 
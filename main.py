@@ -1,6 +1,7 @@
 """Demo script for setting up Hydrus with any db and any API Doc."""
 
-from sqlalchemy import create_engine
+import os
+from hydrus.data.engine import create_db_engine
 from sqlalchemy.orm import sessionmaker,scoped_session
 from hydrus.utils import Getter_setter
 from hydrus.app import app_factory
@@ -13,10 +14,9 @@ from gevent.wsgi import WSGIServer
 
 
 if __name__ == "__main__":
-    # The database connection URL
+    # The database connection URL, e.g. HYDRUS_DB_URL=sqlite:///database.db
     # See http://docs.sqlalchemy.org/en/rel_1_0/core/engines.html#sqlalchemy.create_engine for more info
-    # DB_URL = 'sqlite:///database.db'
-    DB_URL = 'sqlite:///:memory:'
+    DB_URL = os.environ.get("HYDRUS_DB_URL", "sqlite:///:memory:")
 
     # Define the server URL, this is what will be displayed on the Doc
     HYDRUS_SERVER_URL = "http://localhost:8080/"
@@ -26,7 +26,11 @@ if __name__ == "__main__":
 
     print("Setting up the database")
     # Create a connection to the database you want to use
-    engine = create_engine(DB_URL)
+    # SQLite uses the tuned profile unless HYDRUS_SQLITE_PROFILE names another, unset
+    # HYDRUS_JOURNAL_MODE and HYDRUS_SYNCHRONOUS keep the pragmas of the profile
+    engine = create_db_engine(DB_URL, sqlite_profile=os.environ.get("HYDRUS_SQLITE_PROFILE", "tuned"),
+                              journal_mode=os.environ.get("HYDRUS_JOURNAL_MODE"),
+                              synchronous=os.environ.get("HYDRUS_SYNCHRONOUS"))
 
     print("Creating models")
     # Add the required Models to the database
@@ -50,14 +54,14 @@ if __name__ == "__main__":
 
     # Insert them into the database
     doc_parse.insert_classes(classes, session)
-    doc_parse.insert_properties(properties, session)
+    doc_parse.insert_properties(properties, session, doc_parse.get_property_ranges(classes))
 
     print("Adding authorized users")
     add_user(id_=1, paraphrase="test", session=session)
 
     # Insert them into the database
     doc_parse.insert_classes(classes, session)
-    doc_parse.insert_properties(properties, session)
+    doc_parse.insert_properties(properties, session, doc_parse.get_property_ranges(classes))
 
     getter_setter = Getter_setter(session, HYDRUS_SERVER_URL, API_NAME, apidoc, True)
     print("Creating the application")
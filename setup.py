@@ -14,7 +14,7 @@ setup(name='hydrus',
       python_requires='>=3',
       install_requires=[
           'MarkupSafe==1.0',
-          'SQLAlchemy==1.1.10',
+          'SQLAlchemy>=1.4,<2.0',
           'Werkzeug==0.12.2',
           'aniso8601==1.2.1',
           'appdirs==1.4.3',
@@ -35,13 +35,17 @@ setup(name='hydrus',
           'mypy',
           'Click',
           'gevent==1.2.2',
-           'falcon'
+           'falcon>=3'
       ],
+      extras_require={
+          # hydrus serve --asgi
+          'asgi': ['uvicorn', 'aiosqlite', 'asyncpg'],
+      },
       packages=find_packages(exclude=['contrib', 'docs', 'tests*', 'hydrus.egg-info']),
       package_dir={'hydrus':
                     'hydrus'},
       entry_points='''
             [console_scripts]
-            hydrus=cli:startserver
+            hydrus=cli:hydrus
         '''
       )